@@ -1,8 +1,23 @@
+import atexit
 import logging
+import queue
 import sys
 from pathlib import Path
 from logging import Logger
-from logging.handlers import RotatingFileHandler
+from typing import Optional, Set
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+LOG_DATEFMT = "%Y-%m-%d %H:%M:%S"
+
+# Formatter compartido por todos los handlers de archivo
+_FORMATTER = logging.Formatter(fmt=LOG_FORMAT, datefmt=LOG_DATEFMT)
+
+# Directorios de logs ya creados en este proceso
+_ENSURED_LOG_DIRS: Set[Path] = set()
+
+# Hilo que escribe a disco los registros encolados (modo solo archivo)
+_QUEUE_LISTENER: Optional[QueueListener] = None
 
 def get_file_handler(
     log_file: str = "logs/excel_chatbot.log",
@@ -12,9 +27,11 @@ def get_file_handler(
     """
     Crea un handler para escribir logs a archivo con rotación.
     """
-    # Crear directorio si no existe
-    log_path = Path(log_file)
-    log_path.parent.mkdir(exist_ok=True)
+    # Crear directorio si no existe (una sola vez por proceso)
+    log_dir = Path(log_file).parent
+    if log_dir not in _ENSURED_LOG_DIRS:
+        log_dir.mkdir(exist_ok=True)
+        _ENSURED_LOG_DIRS.add(log_dir)
     
     handler = RotatingFileHandler(
         log_file,
@@ -22,23 +39,56 @@ def get_file_handler(
         backupCount=backup_count,
         encoding='utf-8'
     )
-    
-    formatter = logging.Formatter(
-        fmt="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S"
-    )
-    handler.setFormatter(formatter)
+    handler.setFormatter(_FORMATTER)
     
     return handler
 
+def _has_file_handler(log_file: str) -> bool:
+    """Indica si el logger raíz ya escribe (vía la cola) en el archivo indicado."""
+    if _QUEUE_LISTENER is None:
+        return False
+    target = str(Path(log_file).resolve())
+    return any(
+        isinstance(handler, RotatingFileHandler) and handler.baseFilename == target
+        for handler in _QUEUE_LISTENER.handlers
+    )
+
+def _stop_queue_listener() -> None:
+    """Vacía la cola pendiente y cierra los handlers del listener."""
+    global _QUEUE_LISTENER
+    if _QUEUE_LISTENER is None:
+        return
+    _QUEUE_LISTENER.stop()
+    for handler in _QUEUE_LISTENER.handlers:
+        handler.close()
+    _QUEUE_LISTENER = None
+
+atexit.register(_stop_queue_listener)
+
+def _start_queue_listener(*handlers: logging.Handler) -> QueueHandler:
+    """
+    Arranca un QueueListener sobre `handlers` y devuelve el QueueHandler que lo alimenta:
+    quien registra solo encola el registro y la escritura a disco ocurre en otro hilo.
+    """
+    global _QUEUE_LISTENER
+    _stop_queue_listener()
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    _QUEUE_LISTENER = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _QUEUE_LISTENER.start()
+    return QueueHandler(log_queue)
+
 def configure_logging(
     level: str = "INFO",
-    fmt: str = "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    datefmt: str = "%Y-%m-%d %H:%M:%S"
+    fmt: str = LOG_FORMAT,
+    datefmt: str = LOG_DATEFMT
 ) -> Logger:
     """
     Configura el logging global de la aplicación con salida a terminal y archivo.
     """
+    # basicConfig no hace nada si ya hay handlers: evitar abrir un archivo que se descartaría
+    if logging.root.handlers:
+        return logging.getLogger()
+    
     # Configurar logging con terminal y archivo
     logging.basicConfig(
         level=getattr(logging, level.upper(), logging.INFO),
@@ -61,21 +111,28 @@ def configure_file_only_logging(
     """
     Configura logging solo a archivo, sin salida a terminal.
     """
-    logging.basicConfig(
-        level=getattr(logging, level.upper(), logging.INFO),
-        handlers=[get_file_handler(log_file)],
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        force=True
-    )
+    root = logging.getLogger()
+    
+    # Ya configurado para este archivo: no duplicar handlers ni escrituras
+    if len(root.handlers) == 1 and isinstance(root.handlers[0], QueueHandler) and _has_file_handler(log_file):
+        root.setLevel(getattr(logging, level.upper(), logging.INFO))
+        return root
+    
+    # Sustituir los handlers actuales (equivalente a basicConfig(force=True)). El QueueHandler
+    # no lleva formatter propio: el formato lo aplica el handler de archivo en el listener
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(_start_queue_listener(get_file_handler(log_file)))
+    root.setLevel(getattr(logging, level.upper(), logging.INFO))
     
     # Silenciar logs de librerías externas en terminal
     logging.getLogger("httpx").setLevel(logging.WARNING)
     logging.getLogger("groq").setLevel(logging.WARNING)
     logging.getLogger("httpcore").setLevel(logging.WARNING)
     
-    logger = logging.getLogger()
-    logger.info(f"Logging configurado solo a archivo: {log_file}")
-    return logger
+    root.info("Logging configurado solo a archivo: %s", log_file)
+    return root
 
 def get_logger(name: str) -> Logger:
     """
@@ -1,5 +1,7 @@
 from pydantic_settings import BaseSettings
 from pydantic import Field
+from functools import lru_cache
+from typing import Optional
 import os
 from pathlib import Path
 
@@ -14,6 +16,14 @@ class Settings(BaseSettings):
     sandbox_memory_bytes: int = 200 * 1024 * 1024
     sandbox_user: str = "nobody"
     sandbox_temp_dir: str
+    # Reutilizar un worker Python persistente en lugar de un proceso por consulta (solo Unix)
+    sandbox_persistent_worker: bool = True
+
+    # Web: hilos para ejecutar consultas sin bloquear el event loop
+    query_workers: int = 8
+    # Agentes en memoria: máximo simultáneo y segundos de inactividad antes de liberarlos
+    max_agents: int = 16
+    agent_idle_ttl: int = 3600
 
     # Excel
     excel_default_sheet: str = "0"
@@ -22,11 +32,13 @@ class Settings(BaseSettings):
         env_file = ".env"
         env_file_encoding = "utf-8"
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        # Crear directorio de sandbox si no existe
-        Path(self.sandbox_temp_dir).mkdir(exist_ok=True)
-
+@lru_cache(maxsize=1)
 def get_settings() -> Settings:
     """Devuelve una instancia singleton de Settings."""
-    return Settings()
\ No newline at end of file
+    return Settings()
+
+def ensure_dirs(settings: Optional[Settings] = None) -> None:
+    """Crea los directorios requeridos por la configuración (una vez al arrancar)."""
+    settings = settings or get_settings()
+    # Crear directorio de sandbox si no existe
+    Path(settings.sandbox_temp_dir).mkdir(exist_ok=True)
@@ -11,17 +11,83 @@ Autor: Excel Agent
 """
 
 import os
-from typing import Any, Optional, Dict
+import re
+import threading
+import unicodedata
+import weakref
+from collections import OrderedDict
+from typing import Any, Optional, Dict, Tuple
 from groq import Groq
 import logging
 from core.cache.persistent_cache import persistent_cache
 from core.executor.sandbox_executor import SandboxExecutor
 from core.client_manager import ClientConfig
 from utils import ExecutionError, PromptError, parse_output
+from config.settings import get_settings
 from config.logger_config import get_logger
 
 logger = get_logger(__name__)
 
+# Marcas de bloque de código markdown (```python ... ```) en la respuesta del LLM
+_FENCE_RE = re.compile(r'\A```(?:python|py)?[ \t]*\n?|\n?```\s*\Z')
+
+# Signos de interrogación/exclamación y espacios, irrelevantes para el significado de la pregunta
+_QUESTION_MARKS_RE = re.compile(r'[¿?¡!]+')
+_SPACES_RE = re.compile(r'\s+')
+
+def _normalize_question(question: str) -> str:
+    """
+    Forma canónica de una pregunta para el caché de respuestas.
+
+    Ignora mayúsculas, tildes, ¿?¡!, el punto final y los espacios repetidos, de modo que
+    "¿Cuántas filas tiene el Excel?" y "cuantas filas tiene el excel" comparten entrada.
+    El resto de símbolos (<, >, %, decimales...) se conserva porque cambia la consulta.
+    """
+    decomposed = unicodedata.normalize('NFKD', question.casefold())
+    without_marks = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    collapsed = _SPACES_RE.sub(' ', _QUESTION_MARKS_RE.sub(' ', without_marks))
+    return collapsed.strip().rstrip('.').rstrip()
+
+# Clientes Groq compartidos por api_key (reutiliza el pool de conexiones HTTP entre agentes)
+_GROQ_CLIENTS: Dict[str, Groq] = {}
+_GROQ_CLIENTS_LOCK = threading.Lock()
+
+# persistent_cache es un singleton compartido por todos los agentes: cargar un archivo
+# y leer su esquema debe ser atómico frente a consultas de otros clientes
+_PERSISTENT_CACHE_LOCK = threading.Lock()
+
+def _get_groq_client(api_key: str) -> Groq:
+    """Obtiene (o crea una sola vez) el cliente Groq asociado a una api_key."""
+    with _GROQ_CLIENTS_LOCK:
+        client = _GROQ_CLIENTS.get(api_key)
+        if client is None:
+            client = _GROQ_CLIENTS[api_key] = Groq(api_key=api_key)
+        return client
+
+# Prompt base del sistema, común a todos los clientes
+_BASE_SYSTEM_PROMPT = """Eres un experto en pandas que genera código Python para analizar datos Excel.
+
+REGLAS CRÍTICAS:
+1. El DataFrame YA ESTÁ CARGADO en la variable 'df' - NO lo cargues
+2. Genera código Python válido y ejecutable
+3. NO uses markdown (```python) - solo código plano
+4. USA SIEMPRE 4 ESPACIOS para indentación, nunca tabs
+5. Cada línea debe empezar sin espacios extra al inicio
+
+CÓDIGO SEGURO Y CONSISTENTE:
+- Para filtrar NaN: df_clean = df.dropna(subset=['columna']).copy()
+- Para contar: df['columna'].value_counts()
+- Para máximos: .idxmax() y .max()
+- Convierte a string cuando sea necesario: .astype(str)
+- USA print() para mostrar resultados finales
+- Para caracteres especiales usa: print(f"Texto: {variable}")
+- Evita usar comillas simples en strings con acentos
+
+EJEMPLO DE FORMATO CORRECTO:
+df_clean = df.dropna(subset=['numbercall']).copy()
+counts = df_clean['numbercall'].value_counts()
+print(f"Resultado: {counts.idxmax()}")"""
+
 class BaseAgent:
     """
     Agente base modular que integra configuración de clientes.
@@ -33,6 +99,9 @@ class BaseAgent:
     4. Ejecuta código generado localmente sobre el DataFrame cacheado
     """
     
+    # Respuestas memorizadas por (archivo, versión del archivo, hoja, pregunta normalizada)
+    RESPONSE_CACHE_SIZE = 256
+    
     def __init__(
         self,
         client_config: ClientConfig,
@@ -54,17 +123,35 @@ class BaseAgent:
             sandbox_user: Usuario para sandbox
         """
         self.client_config = client_config
-        self.api_key = api_key or os.getenv("GROQ_API_KEY")
+        self._system_prompt = _BASE_SYSTEM_PROMPT + self._specialized_suffix()
+        if not api_key:
+            # Única fuente de configuración: Settings (memoizado) ya lee GROQ_API_KEY del entorno/.env.
+            # Un error de validación de Settings se propaga tal cual
+            api_key = get_settings().groq_api_key
+        self.api_key = api_key
         if not self.api_key:
             raise ValueError("GROQ_API_KEY no está definida.")
         
-        self.client = Groq(api_key=self.api_key)
+        self.client = _get_groq_client(self.api_key)
         self.model = model
+        self._prompt_prefix: Optional[str] = None
+        self._prompt_suffix: Optional[str] = None
+        # Esquema del DataFrame de este agente (no el último cargado en el caché compartido)
+        self._schema_summary: Optional[Dict[str, Any]] = None
+        # Versión (ruta, mtime, tamaño, hoja) del archivo cargado: si cambia, se recarga
+        self._loaded_version: Optional[Tuple] = None
+        self._df_ready = False
+        # Referencia débil al DataFrame inyectado: detecta reinyecciones sin retenerlo en memoria
+        self._injected_df_ref: Optional[weakref.ref] = None
         self.sandbox = SandboxExecutor(
             cpu_time=cpu_time, 
             memory_bytes=memory_bytes, 
             user_name=sandbox_user
         )
+        self._response_cache: "OrderedDict[Tuple, Any]" = OrderedDict()
+        self._response_lock = threading.Lock()
+        # Serializa las consultas concurrentes al mismo agente (sandbox y estado del DataFrame)
+        self._ask_lock = threading.Lock()
         
         logger.info(f"✅ BaseAgent inicializado para cliente: {client_config.client_name}")
         logger.info(f"   Modelo: {model}")
@@ -83,15 +170,30 @@ class BaseAgent:
         """
         try:
             logger.info(f"🔄 Precargando DataFrame desde: {excel_path}")
+            # Versión tomada antes de leer: una modificación durante la carga fuerza otra recarga
+            version = self._file_version(excel_path, sheet_name)
             logger.info(f"   Cliente: {self.client_config.client_name}")
             
-            persistent_cache.load_dataframe(excel_path, sheet_name)
+            # load_dataframe ya devuelve el DataFrame cargado: sin segunda consulta al caché.
+            # El esquema se lee bajo el mismo lock para que corresponda a este DataFrame
+            with _PERSISTENT_CACHE_LOCK:
+                df = persistent_cache.load_dataframe(excel_path, sheet_name)
+                schema_summary = persistent_cache.get_schema_summary()
             
-            # Inyectar DataFrame en el sandbox para que esté disponible
-            df = persistent_cache.get_dataframe()
+            # Inyectar DataFrame en el sandbox para que esté disponible (solo si cambió)
             if df is not None:
-                self.sandbox.inject_dataframe(df)
-                logger.info("✅ DataFrame precargado e inyectado en sandbox exitosamente")
+                if self._injected_df_ref is not None and self._injected_df_ref() is df:
+                    logger.info("✅ DataFrame ya inyectado en sandbox, se omite la reinyección")
+                else:
+                    self.sandbox.inject_dataframe(df)
+                    self._injected_df_ref = weakref.ref(df)
+                    logger.info("✅ DataFrame precargado e inyectado en sandbox exitosamente")
+            
+            # Especializar el prompt al esquema recién cargado
+            self._schema_summary = schema_summary
+            self._prepare_prompt_template()
+            self._loaded_version = version
+            self._df_ready = True
             
             return True
         except Exception as e:
@@ -99,45 +201,29 @@ class BaseAgent:
             return False
     
     def is_dataframe_ready(self) -> bool:
-        """Verifica si el DataFrame está listo para usar."""
-        return persistent_cache.is_loaded()
+        """Verifica si el DataFrame está listo para usar (estado local del agente)."""
+        return self._df_ready
     
-    def _build_system_prompt(self) -> str:
+    def _specialized_suffix(self) -> str:
         """
-        Construye el prompt del sistema personalizado para el cliente.
+        Calcula el sufijo del prompt del sistema con el contexto del cliente.
         
         Returns:
-            str: Prompt del sistema
+            str: Sufijo a concatenar al prompt base ("" si no hay contexto)
         """
-        base_prompt = """Eres un experto en pandas que genera código Python para analizar datos Excel.
-
-REGLAS CRÍTICAS:
-1. El DataFrame YA ESTÁ CARGADO en la variable 'df' - NO lo cargues
-2. Genera código Python válido y ejecutable
-3. NO uses markdown (```python) - solo código plano
-4. USA SIEMPRE 4 ESPACIOS para indentación, nunca tabs
-5. Cada línea debe empezar sin espacios extra al inicio
-
-CÓDIGO SEGURO Y CONSISTENTE:
-- Para filtrar NaN: df_clean = df.dropna(subset=['columna']).copy()
-- Para contar: df['columna'].value_counts()
-- Para máximos: .idxmax() y .max()
-- Convierte a string cuando sea necesario: .astype(str)
-- USA print() para mostrar resultados finales
-- Para caracteres especiales usa: print(f"Texto: {variable}")
-- Evita usar comillas simples en strings con acentos
-
-EJEMPLO DE FORMATO CORRECTO:
-df_clean = df.dropna(subset=['numbercall']).copy()
-counts = df_clean['numbercall'].value_counts()
-print(f"Resultado: {counts.idxmax()}")"""
-
-        # Añadir contexto específico del cliente
         specialized_context = self.client_config.get_specialized_prompt_context()
         if specialized_context:
-            base_prompt += f"\n\nCONTEXTO ESPECÍFICO DEL DOMINIO:\n{specialized_context}"
+            return f"\n\nCONTEXTO ESPECÍFICO DEL DOMINIO:\n{specialized_context}"
+        return ""
+    
+    def _build_system_prompt(self) -> str:
+        """
+        Construye el prompt del sistema personalizado para el cliente.
         
-        return base_prompt
+        Returns:
+            str: Prompt del sistema
+        """
+        return self._system_prompt
     
     def generate_code(self, prompt: str) -> str:
         """
@@ -153,7 +239,7 @@ print(f"Resultado: {counts.idxmax()}")"""
             PromptError: Si falla la generación
         """
         try:
-            logger.debug(f"🤖 Generando código con Groq para cliente: {self.client_config.client_name}")
+            logger.debug("🤖 Generando código con Groq para cliente: %s", self.client_config.client_name)
             
             system_prompt = self._build_system_prompt()
             
@@ -173,52 +259,44 @@ print(f"Resultado: {counts.idxmax()}")"""
             )
             
             content = response.choices[0].message.content or ""
-            code = content.strip()
             
-            # Limpiar código 
-            if code.startswith("```python"):
-                code = code.replace("```python", "").replace("```", "").strip()
-            elif code.startswith("```"):
-                code = code.replace("```", "").strip()
-            
-            # Limpiar líneas vacías al inicio y final
-            lines = code.split('\n')
-            lines = [line for line in lines if line.strip()]  # Eliminar líneas vacías
+            code = content.strip()
             
-            # Normalizar indentación (convertir tabs a espacios)
-            normalized_lines = []
-            for line in lines:
-                # Convertir tabs a 4 espacios
-                line = line.expandtabs(4)
-                normalized_lines.append(line)
+            # Limpiar marcas de bloque markdown (solo si la respuesta viene envuelta en ```)
+            if code.startswith("```"):
+                code = _FENCE_RE.sub('', code).strip()
             
-            code = '\n'.join(normalized_lines)
+            # Eliminar líneas vacías y normalizar indentación (tabs a 4 espacios) en una pasada
+            code = '\n'.join([line.expandtabs(4) for line in code.splitlines() if line.strip()])
             
-            logger.debug(f"✅ Código generado y limpiado: {len(code)} caracteres")
+            logger.debug("✅ Código generado y limpiado: %d caracteres", len(code))
             return code
             
         except Exception as e:
             logger.error(f"❌ Error generando código: {e}")
             raise PromptError(f"Error al generar código: {e}")
     
-    def build_prompt(self, question: str) -> str:
+    def _prepare_prompt_template(self) -> None:
         """
-        Construye el prompt para Groq usando solo esquema y ejemplos.
+        Pre-renderiza las secciones constantes del prompt para el DataFrame cargado.
         
-        Args:
-            question: Pregunta del usuario
-            
-        Returns:
-            str: Prompt construido
+        El esquema no cambia mientras el DataFrame siga cargado, así que solo la
+        pregunta del usuario se interpola en cada consulta.
+        
+        Raises:
+            ValueError: Si no hay DataFrame cargado en caché
         """
-        # Obtener resumen del esquema (sin datos completos)
-        schema_summary = persistent_cache.get_schema_summary()
+        # Resumen del esquema (sin datos completos) capturado al precargar
+        schema_summary = self._schema_summary
         
         if not schema_summary:
             raise ValueError("No hay DataFrame cargado en caché")
         
+        column_names = ', '.join(schema_summary.get('column_names', []))
+        dtypes = "\n".join([f"- {col}: {dtype}" for col, dtype in schema_summary.get('dtypes', {}).items()])
+        
         # Construir prompt con información estructural únicamente
-        prompt = f"""
+        self._prompt_prefix = f"""
 INFORMACIÓN DEL DATASET:
 - Cliente: {self.client_config.client_name}
 - Archivo: {schema_summary.get('file_path', 'No especificado')}
@@ -226,16 +304,17 @@ INFORMACIÓN DEL DATASET:
 - Columnas: {schema_summary.get('columns', 0)}
 
 COLUMNAS DISPONIBLES:
-{', '.join(schema_summary.get('column_names', []))}
+{column_names}
 
 TIPOS DE DATOS:
-{chr(10).join(f"- {col}: {dtype}" for col, dtype in schema_summary.get('dtypes', {}).items())}
+{dtypes}
 
 EJEMPLO DE DATOS (primeras filas):
 {schema_summary.get('sample_data', [])}
 
 PREGUNTA DEL USUARIO:
-{question}
+"""
+        self._prompt_suffix = """
 
 INSTRUCCIONES:
 - El DataFrame YA ESTÁ CARGADO en la variable 'df' - NO lo cargues nuevamente
@@ -248,8 +327,21 @@ INSTRUCCIONES:
 - Al filtrar datos, usa df_filtrado = df[condicion].copy() para evitar warnings
 - Usa print() para mostrar resultados importantes y claros
 """
+    
+    def build_prompt(self, question: str) -> str:
+        """
+        Construye el prompt para Groq usando solo esquema y ejemplos.
+        
+        Args:
+            question: Pregunta del usuario
+            
+        Returns:
+            str: Prompt construido
+        """
+        if self._prompt_prefix is None:
+            self._prepare_prompt_template()
         
-        return prompt
+        return f"{self._prompt_prefix}{question}{self._prompt_suffix}"
     
     def ask(self, excel_path: str, question: str, sheet_name: Optional[str] = None) -> Any:
         """
@@ -268,51 +360,106 @@ INSTRUCCIONES:
             ExecutionError: Si falla la ejecución del código
         """
         try:
-            # Verificar si necesita precargar el DataFrame
-            current_file = persistent_cache.get_current_file()
-            if current_file != excel_path:
-                logger.info("🔄 Necesita cargar nuevo DataFrame")
-                if not self.preload_dataframe(excel_path, sheet_name):
-                    raise ValueError("No se pudo cargar el DataFrame")
+            # Preguntas equivalentes sobre la misma versión del archivo no vuelven al LLM
+            version = self._file_version(excel_path, sheet_name)
+            # Archivo inaccesible: sin caché; la precarga falla con el ValueError habitual
+            cache_key = version + (_normalize_question(question),) if version is not None else None
+            with self._response_lock:
+                if cache_key is not None and cache_key in self._response_cache:
+                    self._response_cache.move_to_end(cache_key)
+                    logger.info("⚡ Respuesta obtenida del caché de consultas")
+                    return self._response_cache[cache_key]
             
-            # Verificar que el DataFrame está listo
-            if not self.is_dataframe_ready():
-                raise ValueError("DataFrame no está disponible en caché")
-            
-            # Construir prompt (solo con esquema, no datos completos)
-            prompt = self.build_prompt(question)
-            
-            # Generar código
-            code = self.generate_code(prompt)
-            
-            # Ejecutar código directamente (el DataFrame ya está inyectado en el sandbox)
-            logger.debug("🔄 Ejecutando código en sandbox con DataFrame pre-inyectado...")
-            stdout, stderr = self.sandbox.execute_code(code)
-            
-            if stderr:
-                logger.error(f"❌ Error en sandbox: {stderr}")
-                raise ExecutionError(stderr)
-            
-            # Parsear resultado
-            result = parse_output(stdout)
-            logger.info("✅ Consulta procesada exitosamente")
-            
-            return result
+            # Una consulta a la vez por agente: comparten sandbox, DataFrame inyectado y prompt
+            with self._ask_lock:
+                # Verificar si necesita precargar el DataFrame (camino rápido si ya lo cargó este agente)
+                if version != self._loaded_version or not self.is_dataframe_ready():
+                    logger.info("🔄 Necesita cargar nuevo DataFrame")
+                    if not self.preload_dataframe(excel_path, sheet_name):
+                        raise ValueError("No se pudo cargar el DataFrame")
+                
+                # Verificar que el DataFrame está listo
+                if not self.is_dataframe_ready():
+                    raise ValueError("DataFrame no está disponible en caché")
+                
+                # Construir prompt (solo con esquema, no datos completos)
+                prompt = self.build_prompt(question)
+                
+                # Generar código
+                code = self.generate_code(prompt)
+                
+                # Ejecutar código directamente (el DataFrame ya está inyectado en el sandbox)
+                logger.debug("🔄 Ejecutando código en sandbox con DataFrame pre-inyectado...")
+                stdout, stderr = self.sandbox.execute_code(code)
+                deterministic = self.sandbox.last_deterministic
+                
+                if stderr:
+                    logger.error(f"❌ Error en sandbox: {stderr}")
+                    raise ExecutionError(stderr)
+                
+                # Parsear resultado
+                result = parse_output(stdout)
+                logger.info("✅ Consulta procesada exitosamente")
+                
+                # Código con now(), random()... da otra respuesta en cada ejecución: no se memoriza
+                if deterministic and cache_key is not None:
+                    with self._response_lock:
+                        self._response_cache[cache_key] = result
+                        if len(self._response_cache) > self.RESPONSE_CACHE_SIZE:
+                            self._response_cache.popitem(last=False)
+                
+                return result
             
         except Exception as e:
             logger.error(f"❌ Error procesando consulta: {e}")
             raise
     
+    @staticmethod
+    def _file_version(excel_path: str, sheet_name: Optional[str]) -> Optional[Tuple]:
+        """
+        Versión del archivo (base de la clave del caché de respuestas); mtime y tamaño cambian si se modifica.
+        None si el archivo no existe o no se puede leer.
+        """
+        try:
+            st = os.stat(excel_path)
+        except OSError:
+            return None
+        return (os.path.abspath(excel_path), st.st_mtime_ns, st.st_size, sheet_name)
+    
+    def clear_response_cache(self):
+        """Olvida las respuestas memorizadas."""
+        with self._response_lock:
+            self._response_cache.clear()
+    
     def get_cache_stats(self) -> Dict[str, Any]:
         """Obtiene estadísticas del caché."""
         return persistent_cache.get_stats()
     
     def clear_cache(self):
         """Limpia el caché y el DataFrame inyectado."""
-        persistent_cache.clear_cache()
-        self.sandbox.clear_injected_dataframe()
+        with self._ask_lock:
+            with _PERSISTENT_CACHE_LOCK:
+                persistent_cache.clear_cache()
+            self.sandbox.clear_injected_dataframe()
+            self.clear_response_cache()
+            self._prompt_prefix = None
+            self._schema_summary = None
+            self._loaded_version = None
+            self._df_ready = False
+            self._injected_df_ref = None
         logger.info("🧹 Caché y DataFrame inyectado limpiados")
     
+    def close(self):
+        """Libera el DataFrame inyectado y el worker del sandbox (el caché persistente es compartido)."""
+        # Espera a la consulta en curso: no se le retira el worker ni el DataFrame
+        with self._ask_lock:
+            self.sandbox.clear_injected_dataframe()
+            self.sandbox.close()
+            self.clear_response_cache()
+            self._loaded_version = None
+            self._df_ready = False
+            self._injected_df_ref = None
+    
     def update_client_config(self, new_client_config: ClientConfig):
         """
         Actualiza la configuración del cliente.
@@ -320,5 +467,10 @@ INSTRUCCIONES:
         Args:
             new_client_config: Nueva configuración de cliente
         """
-        self.client_config = new_client_config
+        with self._ask_lock:
+            self.client_config = new_client_config
+            self._system_prompt = _BASE_SYSTEM_PROMPT + self._specialized_suffix()
+            self._prompt_prefix = None
+        # Las respuestas memorizadas se generaron con el prompt del cliente anterior
+        self.clear_response_cache()
         logger.info(f"🔄 Configuración actualizada para cliente: {new_client_config.client_name}")
@@ -3,15 +3,70 @@ Módulo principal de la aplicación Excel Chatbot.
 Maneja toda la lógica de negocio, argumentos, y flujo de sesión.
 """
 import argparse
-import sys
-import os
+import functools
 from pathlib import Path
-from datetime import datetime
-from config.settings import get_settings
 from config.logger_config import configure_logging, configure_file_only_logging, get_logger
-from core.agent.base_agent import BaseAgent
-from utils import parse_output, ExecutionError, CodeAgentError, LoaderError
-from core.client_manager import ClientManager, ClientConfig
+from utils import ExecutionError, CodeAgentError, LoaderError
+from core.client_manager import ClientManager
+
+
+@functools.cache
+def _build_argument_parser() -> argparse.ArgumentParser:
+    """Construye el parser de argumentos una sola vez por proceso."""
+    parser = argparse.ArgumentParser(
+        description="Chatbot interactivo para consultas complejas sobre Excel",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Modos de uso:
+  python main.py                              # Modo interactivo
+  python main.py "¿Cuál es el promedio?"      # Consulta única
+  python main.py --file datos.xlsx            # Especificar archivo
+  python main.py --debug                      # Modo debug
+  python main.py --fast-io                    # Lectura rápida de Excel (python-calamine)
+        """
+    )
+    parser.add_argument(
+        "question",
+        nargs="*",
+        help="Pregunta sobre los datos del Excel (opcional para modo interactivo)"
+    )
+    parser.add_argument(
+        "--file", "-f",
+        default="data/input/demo.xlsx",
+        help="Ruta al archivo Excel (default: data/input/demo.xlsx)"
+    )
+    parser.add_argument(
+        "--sheet", "-s",
+        default=None,
+        help="Nombre o índice de la hoja del Excel a usar (auto-detecta la mejor si no se especifica)"
+    )
+    parser.add_argument(
+        "--list-sheets",
+        action="store_true",
+        help="Mostrar información de todas las hojas del Excel y salir"
+    )
+    parser.add_argument(
+        "--debug",
+        action="store_true",
+        help="Activar modo debug con logging detallado en terminal"
+    )
+    parser.add_argument(
+        "--client", "-c",
+        default="default",
+        help="ID del cliente a usar (default: default). Usa 'list' para ver clientes disponibles"
+    )
+    parser.add_argument(
+        "--fast-io",
+        action="store_true",
+        help="Leer el Excel con el motor calamine (requiere python-calamine; si no, lector estándar)"
+    )
+    parser.add_argument(
+        "--list-clients",
+        action="store_true",
+        help="Mostrar clientes disponibles y salir"
+    )
+    
+    return parser
 
 
 class ExcelChatbotApp:
@@ -24,62 +79,11 @@ class ExcelChatbotApp:
         self.client_config = None
         
     def create_argument_parser(self):
-        """Crear y configurar el parser de argumentos."""
-        parser = argparse.ArgumentParser(
-            description="Chatbot interactivo para consultas complejas sobre Excel",
-            formatter_class=argparse.RawDescriptionHelpFormatter,
-            epilog="""
-Modos de uso:
-  python main.py                              # Modo interactivo
-  python main.py "¿Cuál es el promedio?"      # Consulta única
-  python main.py --file datos.xlsx            # Especificar archivo
-  python main.py --debug                      # Modo debug
-            """
-        )
-        parser.add_argument(
-            "question",
-            nargs="*",
-            help="Pregunta sobre los datos del Excel (opcional para modo interactivo)"
-        )
-        parser.add_argument(
-            "--file", "-f",
-            default="data/input/demo.xlsx",
-            help="Ruta al archivo Excel (default: data/input/demo.xlsx)"
-        )
-        parser.add_argument(
-            "--sheet", "-s",
-            default=None,
-            help="Nombre o índice de la hoja del Excel a usar (auto-detecta la mejor si no se especifica)"
-        )
-        parser.add_argument(
-            "--list-sheets",
-            action="store_true",
-            help="Mostrar información de todas las hojas del Excel y salir"
-        )
-        parser.add_argument(
-            "--debug",
-            action="store_true",
-            help="Activar modo debug con logging detallado en terminal"
-        )
-        parser.add_argument(
-            "--client", "-c",
-            default="default",
-            help="ID del cliente a usar (default: default). Usa 'list' para ver clientes disponibles"
-        )
-        parser.add_argument(
-            "--list-clients",
-            action="store_true",
-            help="Mostrar clientes disponibles y salir"
-        )
-        
-        return parser
+        """Obtener el parser de argumentos (construido una sola vez)."""
+        return _build_argument_parser()
     
     def setup_logging(self, debug_mode: bool):
         """Configurar el sistema de logging."""
-        # Crear directorio de logs si no existe
-        log_dir = Path("logs")
-        log_dir.mkdir(exist_ok=True)
-        
         # Configurar logging - siempre a archivo, solo a terminal si debug
         log_level = "DEBUG" if debug_mode else "INFO"
         
@@ -147,8 +151,13 @@ Modos de uso:
     def initialize_agent(self):
         """Inicializar el agente con la configuración actual."""
         try:
+            # Imports pesados (pydantic-settings, pandas, groq) solo cuando se crea el agente
+            from config.settings import get_settings, ensure_dirs
+            from core.agent.base_agent import BaseAgent
+            
             settings = get_settings()
-            self.logger.info(f"Iniciando agente con modelo {settings.groq_model}") # type: ignore
+            ensure_dirs(settings)
+            self.logger.info("Iniciando agente con modelo %s", settings.groq_model) # type: ignore
             
             self.agent = BaseAgent(
                 client_config=self.client_config, # type: ignore
@@ -171,7 +180,7 @@ Modos de uso:
     def process_question(self, excel_path: str, question: str, specific_sheet=None):
         """Procesar una pregunta del usuario."""
         try:
-            self.logger.info(f"Procesando pregunta: {question}") # type: ignore
+            self.logger.info("Procesando pregunta: %s", question) # type: ignore
             result = self.agent.ask(excel_path, question, sheet_name=specific_sheet) # type: ignore
             return result, None
         except LoaderError as e:
@@ -193,8 +202,8 @@ Modos de uso:
     
     def run_single_query_mode(self, excel_path: str, question: str, specific_sheet=None):
         """Ejecutar modo de consulta única."""
-        self.logger.info(f"Archivo Excel: {excel_path}") # type: ignore
-        self.logger.info(f"Pregunta: {question}") # type: ignore
+        self.logger.info("Archivo Excel: %s", excel_path) # type: ignore
+        self.logger.info("Pregunta: %s", question) # type: ignore
 
         # Inicializar agente
         if not self.initialize_agent():
@@ -260,6 +269,12 @@ Modos de uso:
         # Configurar logging
         self.setup_logging(args.debug)
         
+        # Lector rápido de Excel (opcional)
+        if args.fast_io:
+            from core.cache.persistent_cache import persistent_cache
+            if not persistent_cache.set_fast_io(True):
+                print("⚠️ --fast-io requiere python-calamine (pip install python-calamine); usando lector estándar")
+        
         try:
             # Modo de una sola consulta
             if args.question:
@@ -15,9 +15,15 @@ from pathlib import Path
 from datetime import datetime
 import os
 import hashlib
+import importlib.util
 from config.logger_config import get_logger
 from core.loader.excel_loader import infer_schema, ColumnSchema
 
+try:
+    import pyarrow  # noqa: F401  (necesario para Feather)
+except ImportError:  # pyarrow es opcional: se usa pickle
+    pyarrow = None
+
 logger = get_logger(__name__)
 
 class PersistentDataFrameCache:
@@ -36,9 +42,34 @@ class PersistentDataFrameCache:
         self._schema: Optional[List[ColumnSchema]] = None
         self._file_stats: Optional[Dict[str, Any]] = None
         self._load_time: Optional[datetime] = None
+        # Motor de pandas para leer Excel (None = el predeterminado, openpyxl)
+        self.excel_engine: Optional[str] = None
         
         logger.info(f"📁 Caché persistente inicializado en: {self.cache_dir}")
     
+    def set_fast_io(self, enabled: bool) -> bool:
+        """
+        Activa el lector calamine (Rust) para leer Excel si python-calamine está instalado.
+        
+        Returns:
+            bool: True si el lector rápido quedó activo
+        """
+        if enabled and importlib.util.find_spec("python_calamine") is not None:
+            self.excel_engine = "calamine"
+        else:
+            self.excel_engine = None
+        return self.excel_engine is not None
+    
+    def _read_excel(self, file_path: str, sheet_name: Optional[str]) -> pd.DataFrame:
+        """Lee el Excel con el motor configurado; si falla, con el predeterminado."""
+        kwargs = {'sheet_name': sheet_name} if sheet_name else {}
+        if self.excel_engine:
+            try:
+                return pd.read_excel(file_path, engine=self.excel_engine, **kwargs)
+            except Exception as e:
+                logger.warning(f"⚠️ Lector {self.excel_engine} falló, usando el predeterminado: {e}")
+        return pd.read_excel(file_path, **kwargs)
+    
     def _get_cache_key(self, file_path: str) -> str:
         """Genera clave única para el archivo."""
         # Usar hash del path absoluto
@@ -49,23 +80,52 @@ class PersistentDataFrameCache:
         """Obtiene rutas de archivos de caché."""
         cache_key = self._get_cache_key(file_path)
         return {
-            'dataframe': self.cache_dir / f"{cache_key}_df.pkl",
+            'feather': self.cache_dir / f"{cache_key}_df.feather",
+            'pickle': self.cache_dir / f"{cache_key}_df.pkl",
             'metadata': self.cache_dir / f"{cache_key}_meta.json",
             'schema': self.cache_dir / f"{cache_key}_schema.json"
         }
     
-    def _save_to_disk(self, file_path: str, df: pd.DataFrame, schema: List[ColumnSchema]):
+    @staticmethod
+    def _has_disk_cache(cache_files: Dict[str, Path]) -> bool:
+        """Comprueba que existen metadatos, esquema y el DataFrame en algún formato."""
+        return (cache_files['metadata'].exists() and cache_files['schema'].exists() and
+                (cache_files['feather'].exists() or cache_files['pickle'].exists()))
+    
+    def _write_dataframe(self, cache_files: Dict[str, Path], df: pd.DataFrame) -> str:
+        """
+        Guarda el DataFrame en Feather (Arrow, lectura columnar rápida) y recurre
+        a pickle si pyarrow no está disponible o el DataFrame no es representable
+        en Arrow (columnas con tipos mezclados, nombres de columna no string).
+        
+        Returns:
+            str: Formato usado ('feather' o 'pickle')
+        """
+        # Feather guarda como texto los nombres no str (2020 -> '2020') con solo un aviso
+        if pyarrow is not None and all(isinstance(col, str) for col in df.columns):
+            try:
+                df.to_feather(cache_files['feather'])
+                cache_files['pickle'].unlink(missing_ok=True)
+                return 'feather'
+            except Exception as e:
+                logger.debug(f"Feather no disponible para este DataFrame, usando pickle: {e}")
+                cache_files['feather'].unlink(missing_ok=True)
+        
+        with open(cache_files['pickle'], 'wb') as f:
+            pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+        cache_files['feather'].unlink(missing_ok=True)
+        return 'pickle'
+    
+    def _save_to_disk(self, file_path: str, df: pd.DataFrame, schema: List[ColumnSchema], file_stats: os.stat_result):
         """Guarda DataFrame y metadatos en disco."""
         try:
             cache_files = self._get_cache_files(file_path)
             
             # Guardar DataFrame
             logger.info("💾 Guardando DataFrame en caché persistente...")
-            with open(cache_files['dataframe'], 'wb') as f:
-                pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+            df_format = self._write_dataframe(cache_files, df)
             
             # Guardar metadatos
-            file_stats = os.stat(file_path)
             metadata = {
                 'file_path': file_path,
                 'rows': len(df),
@@ -74,6 +134,7 @@ class PersistentDataFrameCache:
                 'dtypes': {col: str(dtype) for col, dtype in df.dtypes.items()},
                 'file_size': file_stats.st_size,
                 'file_mtime': file_stats.st_mtime,
+                'dataframe_format': df_format,
                 'cache_time': datetime.now().isoformat(),
                 'memory_usage_mb': df.memory_usage(deep=True).sum() / 1024 / 1024
             }
@@ -99,13 +160,13 @@ class PersistentDataFrameCache:
         except Exception as e:
             logger.error(f"❌ Error guardando caché: {e}")
     
-    def _load_from_disk(self, file_path: str) -> bool:
-        """Carga DataFrame y metadatos desde disco."""
+    def _load_from_disk(self, file_path: str, current_stats: os.stat_result) -> bool:
+        """Carga DataFrame y metadatos desde disco si siguen vigentes para `current_stats`."""
         try:
             cache_files = self._get_cache_files(file_path)
             
             # Verificar que todos los archivos existen
-            if not all(f.exists() for f in cache_files.values()):
+            if not self._has_disk_cache(cache_files):
                 logger.debug("Archivos de caché no encontrados")
                 return False
             
@@ -113,7 +174,6 @@ class PersistentDataFrameCache:
             with open(cache_files['metadata'], 'r') as f:
                 cached_metadata = json.load(f)
             
-            current_stats = os.stat(file_path)
             if (current_stats.st_size != cached_metadata['file_size'] or 
                 current_stats.st_mtime != cached_metadata['file_mtime']):
                 logger.info("📄 Archivo modificado, caché obsoleto")
@@ -122,9 +182,13 @@ class PersistentDataFrameCache:
             logger.info("📂 Cargando DataFrame desde caché persistente...")
             start_time = datetime.now()
             
-            # Cargar DataFrame
-            with open(cache_files['dataframe'], 'rb') as f:
-                df = pickle.load(f)
+            # Cargar DataFrame (cachés antiguos sin formato registrado son pickle)
+            df_format = cached_metadata.get('dataframe_format', 'pickle')
+            if df_format == 'feather':
+                df = pd.read_feather(cache_files['feather'])
+            else:
+                with open(cache_files['pickle'], 'rb') as f:
+                    df = pickle.load(f)
             
             # Cargar esquema
             with open(cache_files['schema'], 'r') as f:
@@ -183,31 +247,30 @@ class PersistentDataFrameCache:
         Returns:
             pd.DataFrame: DataFrame cargado
         """
-        # Verificar si ya está cargado
+        # Un único stat: existencia, vigencia de la copia en memoria, validez del caché en disco y metadatos a guardar
+        try:
+            file_stats = os.stat(file_path)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Archivo Excel no encontrado: {file_path}")
+        
+        # Verificar si ya está cargado (y el archivo no ha cambiado desde entonces)
         if (self._dataframe is not None and 
-            self._file_path == file_path):
+            self._file_path == file_path and
+            self._file_stats == {'size': file_stats.st_size, 'mtime': file_stats.st_mtime}):
             logger.info("✅ DataFrame ya está en memoria")
             return self._dataframe
         
         # Intentar cargar desde caché persistente
-        if self._load_from_disk(file_path):
+        if self._load_from_disk(file_path, file_stats):
             return self._dataframe  # type: ignore
         
         # Si no hay caché, cargar desde Excel
         logger.info(f"📊 Cargando DataFrame desde Excel: {file_path}")
         start_time = datetime.now()
         
-        # Verificar que el archivo existe
-        excel_path = Path(file_path)
-        if not excel_path.exists():
-            raise FileNotFoundError(f"Archivo Excel no encontrado: {file_path}")
-        
         try:
             # Cargar DataFrame
-            if sheet_name:
-                df = pd.read_excel(file_path, sheet_name=sheet_name)
-            else:
-                df = pd.read_excel(file_path)
+            df = self._read_excel(file_path, sheet_name)
             
             # Generar esquema
             schema = infer_schema(df)
@@ -218,7 +281,6 @@ class PersistentDataFrameCache:
             self._schema = schema
             self._load_time = datetime.now()
             
-            file_stats = os.stat(file_path)
             self._file_stats = {
                 'size': file_stats.st_size,
                 'mtime': file_stats.st_mtime
@@ -235,7 +297,7 @@ class PersistentDataFrameCache:
             print(f"⏱️  Tiempo de carga: {load_duration:.2f} segundos")
             
             # Guardar en caché persistente para la próxima vez
-            self._save_to_disk(file_path, df, schema)
+            self._save_to_disk(file_path, df, schema, file_stats)
             
             return df
             
@@ -306,8 +368,8 @@ class PersistentDataFrameCache:
             'memory_usage_mb': df.memory_usage(deep=True).sum() / 1024 / 1024,
             'load_time': self._load_time.isoformat() if self._load_time else None,
             'file_size_mb': self._file_stats['size'] / 1024 / 1024 if self._file_stats else None,
-            'has_disk_cache': all(f.exists() for f in cache_files.values()),
-            'cache_files': [str(f) for f in cache_files.values()]
+            'has_disk_cache': self._has_disk_cache(cache_files),
+            'cache_files': [str(f) for f in cache_files.values() if f.exists()]
         }
     
     def clear_cache(self, remove_disk_cache: bool = False):
@@ -329,10 +391,11 @@ class PersistentDataFrameCache:
         # Limpiar disco si se solicita
         if remove_disk_cache:
             try:
-                for cache_file in self.cache_dir.glob("*"):
-                    if cache_file.is_file():
-                        cache_file.unlink()
-                        logger.info(f"🗑️  Eliminado: {cache_file}")
+                with os.scandir(self.cache_dir) as entries:
+                    for entry in entries:
+                        if entry.is_file(follow_symlinks=False):
+                            os.unlink(entry.path)
+                            logger.info(f"🗑️  Eliminado: {entry.path}")
             except Exception as e:
                 logger.error(f"❌ Error limpiando caché de disco: {e}")
     
@@ -341,15 +404,24 @@ class PersistentDataFrameCache:
         try:
             cutoff_time = datetime.now().timestamp() - (max_age_days * 24 * 3600)
             cleaned = 0
+
+            # Fase 1: recopilar candidatos (os.scandir reutiliza el tipo de entrada: un stat por archivo)
+            with os.scandir(self.cache_dir) as entries:
+                doomed = [
+                    entry.path for entry in entries
+                    if entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < cutoff_time
+                ]
             
-            for cache_file in self.cache_dir.glob("*"):
-                if cache_file.is_file() and cache_file.stat().st_mtime < cutoff_time:
-                    cache_file.unlink()
+            # Fase 2: eliminar sin logging intermedio
+            for path in doomed:
+                try:
+                    os.unlink(path)
                     cleaned += 1
-                    logger.info(f"🗑️  Eliminado caché antiguo: {cache_file}")
+                except OSError:
+                    pass  # Ignorar errores de limpieza
             
             if cleaned > 0:
-                logger.info(f"🧹 Limpiados {cleaned} archivos de caché antiguos")
+                logger.info("🧹 Limpiados %d archivos de caché antiguos", cleaned)
             
         except Exception as e:
             logger.error(f"❌ Error limpiando caché antiguo: {e}")
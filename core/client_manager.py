@@ -3,10 +3,11 @@ Sistema de configuración de clientes para Excel Agent.
 Permite personalizar la aplicación para diferentes clientes sin cambiar código.
 """
 
-import json
+import os
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
 from dataclasses import dataclass
+from utils import loads_bytes, dumps_bytes
 
 @dataclass
 class ClientConfig:
@@ -21,8 +22,7 @@ class ClientConfig:
     @classmethod
     def from_json_file(cls, config_path: str) -> 'ClientConfig':
         """Carga configuración desde archivo JSON."""
-        with open(config_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = loads_bytes(Path(config_path).read_bytes())
         
         return cls(
             client_name=data.get('client_name', 'Excel Agent'),
@@ -84,7 +84,42 @@ class ClientManager:
     def __init__(self, clients_dir: str = "clients"):
         self.clients_dir = Path(clients_dir)
         self.clients_dir.mkdir(exist_ok=True)
+        # Configs ya parseadas: ruta -> (st_mtime_ns, ClientConfig)
+        self._cache: Dict[str, Tuple[int, ClientConfig]] = {}
         self._create_default_config()
+        # Índice workspace_folder -> client_id, reconstruido si cambia el directorio
+        self._workspace_index: Dict[str, str] = {}
+        self._index_mtime_ns: Optional[int] = None
+        self._refresh_workspace_index()
+    
+    def _refresh_workspace_index(self):
+        """Reconstruye el índice de carpetas solo si el directorio de clientes cambió."""
+        mtime_ns = os.stat(self.clients_dir).st_mtime_ns
+        if mtime_ns == self._index_mtime_ns:
+            return
+        
+        index: Dict[str, str] = {}
+        for client_file in self.clients_dir.glob("*.json"):
+            try:
+                config = self._load_cached(client_file)
+            except Exception:
+                continue
+            index.setdefault(config.get_workspace_folder(), config.client_id)
+        
+        self._workspace_index = index
+        self._index_mtime_ns = mtime_ns
+    
+    def _load_cached(self, path: Path) -> ClientConfig:
+        """Carga una configuración reutilizando la versión parseada si el archivo no cambió."""
+        st = os.stat(path)
+        key = str(path)
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] == st.st_mtime_ns:
+            return entry[1]
+        
+        config = ClientConfig.from_json_file(key)
+        self._cache[key] = (st.st_mtime_ns, config)
+        return config
     
     def _create_default_config(self):
         """Crea configuración por defecto si no existe."""
@@ -122,8 +157,33 @@ class ClientManager:
                 }
             }
             
-            with open(default_path, 'w', encoding='utf-8') as f:
-                json.dump(default_config, f, indent=2, ensure_ascii=False)
+            default_path.write_bytes(dumps_bytes(default_config, indent=True))
+    
+    def invalidate(self, client_id: Optional[str] = None):
+        """
+        Descarta configuraciones memorizadas para forzar su relectura.
+        
+        Args:
+            client_id: Cliente a invalidar; si es None se invalidan todos
+        """
+        if client_id is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(str(self.clients_dir / f"{client_id}.json"), None)
+        # El índice de carpetas se reconstruye en la próxima consulta
+        self._index_mtime_ns = None
+    
+    def mtime(self) -> int:
+        """
+        Versión de las configuraciones: mayor mtime (ns) entre el directorio
+        de clientes y sus archivos JSON. Cambia al crear, borrar o editar un cliente.
+        """
+        latest = os.stat(self.clients_dir).st_mtime_ns
+        with os.scandir(self.clients_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith('.json'):
+                    latest = max(latest, entry.stat().st_mtime_ns)
+        return latest
     
     def list_clients(self) -> List[str]:
         """Lista todos los clientes disponibles."""
@@ -137,17 +197,9 @@ class ClientManager:
             # Fallback a configuración por defecto
             config_path = self.clients_dir / "default.json"
             
-        return ClientConfig.from_json_file(str(config_path))
+        return self._load_cached(config_path)
     
     def auto_detect_client(self, data_folder: str) -> str:
         """Auto-detecta cliente basado en la carpeta de datos."""
-        # Lógica simple: buscar si hay un cliente que use esa carpeta
-        for client_file in self.clients_dir.glob("*.json"):
-            try:
-                config = ClientConfig.from_json_file(str(client_file))
-                if config.get_workspace_folder() == data_folder:
-                    return config.client_id
-            except:
-                continue
-        
-        return "default"
+        self._refresh_workspace_index()
+        return self._workspace_index.get(data_folder, "default")
@@ -4,25 +4,166 @@ import os
 import sys
 import platform
 import ast
-import re
+import hashlib
 import pickle
+import re
+import socket
+import stat
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.connection import Connection
 from pathlib import Path
-from typing import Set, List, Optional
+from typing import Any, Dict, Set, FrozenSet, List, Optional, Tuple
 import pandas as pd
 from config.settings import get_settings
 from config.logger_config import get_logger
+from utils import loads_bytes, dumps_bytes
+
+# pyarrow es opcional: permite compartir el DataFrame en formato Arrow IPC
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
 
-# Solo importar resource y pwd en sistemas Unix
+# Solo importar pwd en sistemas Unix
 if platform.system() != 'Windows':
-    import resource
     import pwd
 
 logger = get_logger(__name__)
 
+WORKER_SCRIPT = Path(__file__).with_name('sandbox_worker.py')
+
+# Directorio en memoria (tmpfs) para el DataFrame inyectado, si el sistema lo ofrece.
+# Uno por usuario: /dev/shm es compartido y el de otro usuario no es de fiar
+SHM_DIR = Path(f'/dev/shm/excel_agent-{os.getuid()}') if hasattr(os, 'getuid') else None
+
+# Última limpieza de cada directorio temporal (compartida entre instancias)
+_LAST_CLEANUP: Dict[str, float] = {}
+# Por directorio: (mtime al escanear, instante en que caduca el archivo superviviente más antiguo)
+_CLEANUP_SNAPSHOT: Dict[str, Tuple[int, float]] = {}
+_CLEANUP_LOCK = threading.Lock()
+
+# Nombres dunder dentro de cadenas ('__class__.__mro__' en attrgetter o format)
+_DUNDER_RE = re.compile(r'__\w+__')
+
 class SecurityError(Exception):
     """Error de seguridad en validación de código."""
     pass
 
+class _SecurityVisitor(ast.NodeVisitor):
+    """
+    Recorre el AST una sola vez recogiendo los módulos importados
+    y la primera llamada o acceso a atributo prohibido.
+    """
+    
+    DANGEROUS_METHODS = frozenset({'system', 'popen', 'call'})
+    
+    # Llamadas cuyo resultado varía entre ejecuciones (su salida no se cachea)
+    NONDETERMINISTIC_CALLS = frozenset({
+        'now', 'today', 'utcnow',
+        'random', 'rand', 'randn', 'randint', 'default_rng',
+        'choice', 'shuffle', 'sample', 'permutation'
+    })
+    # Constructores de fechas que aceptan 'now'/'today' como valor: pd.Timestamp('now'), pd.to_datetime('today')
+    DATE_PARSERS = frozenset({'Timestamp', 'to_datetime', 'datetime64', 'date_range', 'period_range', 'Period'})
+    RELATIVE_DATES = frozenset({'now', 'today'})
+    
+    def __init__(self, forbidden_functions: FrozenSet[str]):
+        self.forbidden_functions = forbidden_functions
+        self.imports: Set[str] = set()
+        # Atributos '_' sobre df (df._mgr, df['a']._values): válidos mientras df sea el DataFrame inyectado
+        self.private_df_attrs: List[str] = []
+        self.df_rebound = False
+        self.violation: Optional[str] = None
+        self.deterministic = True
+    
+    def _flag(self, message: str) -> None:
+        if self.violation is None:
+            self.violation = message
+    
+    def visit(self, node: ast.AST) -> None:
+        # Cualquier enlace del nombre df (asignación, parámetro, import, def, except...) impide
+        # asegurar que df sea el DataFrame inyectado
+        if isinstance(node, ast.Name):
+            rebinds = node.id == 'df' and not isinstance(node.ctx, ast.Load)
+        elif isinstance(node, ast.arg):
+            rebinds = node.arg == 'df'
+        elif isinstance(node, ast.alias):
+            rebinds = (node.asname or node.name) == 'df'
+        else:
+            rebinds = getattr(node, 'name', None) == 'df' or getattr(node, 'rest', None) == 'df'
+        if rebinds:
+            self.df_rebound = True
+        super().visit(node)
+    
+    def visit_Module(self, node: ast.Module) -> None:
+        self.generic_visit(node)
+        if self.df_rebound and self.private_df_attrs:
+            self._flag(f"Acceso a atributo privado prohibido: {self.private_df_attrs[0]} (df reasignado)")
+    
+    def visit_Import(self, node: ast.Import) -> None:
+        for alias in node.names:
+            self.imports.add(alias.name.split('.')[0])  # Solo el módulo principal
+            if any(part.startswith('_') for part in alias.name.split('.')):
+                self._flag(f"Import de módulo interno prohibido: {alias.name}")
+    
+    def visit_ImportFrom(self, node: ast.ImportFrom) -> None:
+        # Los imports relativos ('from . import x') nunca están permitidos
+        module = node.module if node.level == 0 and node.module else '.'
+        self.imports.add(module.split('.')[0])
+        for alias in node.names:
+            if alias.name.startswith('_') or any(part.startswith('_') for part in module.split('.')):
+                self._flag(f"Import de módulo interno prohibido: {module}.{alias.name}")
+    
+    def visit_Call(self, node: ast.Call) -> None:
+        func = node.func
+        name = func.id if isinstance(func, ast.Name) else getattr(func, 'attr', None)
+        if name in self.NONDETERMINISTIC_CALLS:
+            self.deterministic = False
+        elif name in self.DATE_PARSERS:
+            values = [*node.args, *(kw.value for kw in node.keywords)]
+            if any(isinstance(v, ast.Constant) and isinstance(v.value, str)
+                   and v.value.strip().lower() in self.RELATIVE_DATES for v in values):
+                self.deterministic = False
+        if isinstance(func, ast.Name) and func.id in self.forbidden_functions:
+            self._flag(f"Función prohibida detectada: {func.id}()")
+        elif isinstance(func, ast.Attribute) and func.attr in self.forbidden_functions:
+            # pd.eval(), df.eval()... evalúan expresiones igual que eval()
+            self._flag(f"Función prohibida detectada: {func.attr}()")
+        elif isinstance(func, ast.Attribute) and func.attr in self.DANGEROUS_METHODS:
+            self._flag(f"Llamada a {func.attr}() prohibida")
+        self.generic_visit(node)
+    
+    def visit_Attribute(self, node: ast.Attribute) -> None:
+        if node.attr.startswith('__') and node.attr.endswith('__'):
+            self._flag(f"Acceso a atributo privado prohibido: {node.attr}")
+        elif node.attr.startswith('_'):
+            # Solo se permiten sobre el DataFrame (df._mgr, df['a']._values); por cualquier otra
+            # cadena se llega a internos de módulos (pd.io.common.sys._getframe)
+            if self._is_dataframe(node.value):
+                self.private_df_attrs.append(node.attr)
+            else:
+                self._flag(f"Acceso a atributo privado prohibido: {node.attr}")
+        self.generic_visit(node)
+    
+    @staticmethod
+    def _is_dataframe(node: ast.expr) -> bool:
+        """True si la expresión es df o una selección sobre él (df['a'], df[df.x > 0])."""
+        while isinstance(node, ast.Subscript):
+            node = node.value
+        return isinstance(node, ast.Name) and node.id == 'df'
+    
+    def visit_Name(self, node: ast.Name) -> None:
+        if node.id.startswith('__') and node.id.endswith('__'):
+            self._flag("Uso de métodos dunder prohibido")
+    
+    def visit_Constant(self, node: ast.Constant) -> None:
+        # Los dunder también llegan como texto: operator.attrgetter('__class__'), '{0.__class__}'.format()
+        if isinstance(node.value, str) and _DUNDER_RE.search(node.value):
+            self._flag("Uso de métodos dunder prohibido")
+
 class SandboxExecutor:
     """
     Ejecuta código Python en un proceso aislado con límites.
@@ -32,9 +173,9 @@ class SandboxExecutor:
     """
     
     # Imports permitidos (whitelist)
-    ALLOWED_IMPORTS = {
-        'pandas', 'pd',
-        'numpy', 'np', 
+    ALLOWED_IMPORTS = frozenset({
+        'pandas',
+        'numpy',
         'datetime',
         'json',
         'math',
@@ -44,10 +185,10 @@ class SandboxExecutor:
         'itertools',
         'functools',
         'operator'
-    }
+    })
     
     # Imports prohibidos explícitamente (blacklist adicional)
-    FORBIDDEN_IMPORTS = {
+    FORBIDDEN_IMPORTS = frozenset({
         'os', 'sys', 'subprocess', 'shutil', 'glob',
         'socket', 'urllib', 'requests', 'http',
         'ftplib', 'smtplib', 'telnetlib',
@@ -56,15 +197,29 @@ class SandboxExecutor:
         'exec', 'eval', 'compile', '__import__',
         'open', 'file', 'input', 'raw_input',
         'importlib', 'pkgutil', 'imp'
-    }
+    })
     
     # Funciones peligrosas
-    FORBIDDEN_FUNCTIONS = {
+    FORBIDDEN_FUNCTIONS = frozenset({
         'exec', 'eval', 'compile', '__import__',
         'open', 'file', 'input', 'raw_input',
         'getattr', 'setattr', 'delattr', 'hasattr',
         'globals', 'locals', 'vars', 'dir'
-    }
+    })
+    
+    # Limpieza de temporales: antigüedad máxima y frecuencia mínima entre pasadas (segundos)
+    TEMP_FILE_MAX_AGE = 3600
+    CLEANUP_INTERVAL = 600
+    
+    # Número máximo de códigos validados que se recuerdan
+    VALIDATION_CACHE_SIZE = 256
+    # Número máximo de resultados de ejecución que se recuerdan
+    RESULT_CACHE_SIZE = 256
+    
+    # Margen para arrancar el worker (import de pandas) y cargar el DataFrame
+    WORKER_STARTUP_TIMEOUT = 30
+    # Ejecuciones tras las que se recicla el worker persistente
+    WORKER_MAX_CALLS = 500
 
     def __init__(
         self, 
@@ -82,9 +237,11 @@ class SandboxExecutor:
         self.temp_dir = Path(settings.sandbox_temp_dir)
         self.temp_dir.mkdir(exist_ok=True)
         
+        self.gid: Optional[int] = None
         if not self.is_windows:
             try:
-                self.uid = pwd.getpwnam(user_name).pw_uid # type: ignore
+                entry = pwd.getpwnam(user_name) # type: ignore
+                self.uid, self.gid = entry.pw_uid, entry.pw_gid
                 logger.debug(f"Usuario sandbox configurado: {user_name} (UID: {self.uid})")
             except (KeyError, NameError):
                 logger.warning(f"Usuario '{user_name}' no encontrado, ejecutando como usuario actual")
@@ -93,27 +250,121 @@ class SandboxExecutor:
             logger.debug("Ejecutando en Windows, sin restricciones de usuario")
             self.uid = None
         
+        # Directorio donde se escribe el DataFrame inyectado (depende del usuario sandbox)
+        self.data_dir = self._resolve_data_dir()
+        
         self._injected_dataframe_path: Optional[str] = None
+        self._df_fingerprint: Optional[bytes] = None
+        self._setup_bytes = self._build_setup_bytes()
+        
+        # Entorno de los subprocesos (se copia os.environ una sola vez)
+        self._child_env = self._build_child_env()
+        
+        # Hashes de código ya validado (LRU)
+        self._validated: "OrderedDict[bytes, bool]" = OrderedDict()
+        # Resultados de ejecuciones deterministas: (código, DataFrame) -> (stdout, stderr)
+        self._results: "OrderedDict[Tuple[bytes, Any], Tuple[str, str]]" = OrderedDict()
+        # Si el último código ejecutado es determinista (su salida se puede memorizar)
+        self.last_deterministic = False
+        
+        # Worker persistente (solo Unix): se arranca en la primera ejecución
+        self.use_worker = settings.sandbox_persistent_worker and not self.is_windows
+        self._worker: Optional[subprocess.Popen] = None
+        self._worker_conn: Optional[Connection] = None
+        self._worker_df_path: Optional[str] = None
+        self._worker_loaded = False
+        self._worker_calls = 0
+        self._worker_lock = threading.Lock()
+        
+        # Auto-limpiar archivos antiguos (en segundo plano, no en cada instancia)
+        self._schedule_cleanup()
+    
+    def _resolve_data_dir(self) -> Path:
+        """
+        Elige /dev/shm (tmpfs) para el DataFrame inyectado cuando está disponible,
+        de modo que escribirlo y mapearlo no toque el disco. Si no, usa temp_dir.
+        """
+        if self.is_windows or SHM_DIR is None or not os.access('/dev/shm', os.W_OK):
+            return self.temp_dir
+        try:
+            SHM_DIR.mkdir(mode=0o700, exist_ok=True)
+            st = os.lstat(SHM_DIR)
+        except OSError:
+            return self.temp_dir
         
-        # Auto-limpiar archivos antiguos al inicializar
-        self._cleanup_old_files()
+        # Solo un directorio real, propio y privado (no un enlace ni uno creado por otro usuario).
+        # Se admite el permiso de paso (x): el usuario sandbox lo necesita para abrir sus archivos
+        if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o066:
+            logger.warning(f"{SHM_DIR} no es un directorio privado del usuario actual, usando {self.temp_dir}")
+            return self.temp_dir
+        if self._drops_privileges() and st.st_mode & 0o011 != 0o011:
+            try:
+                os.chmod(SHM_DIR, 0o711)  # Paso sin listado: los nombres de mkstemp no se pueden descubrir
+            except OSError:
+                return self.temp_dir
+        return SHM_DIR
     
-    def _cleanup_old_files(self) -> None:
+    def _drops_privileges(self) -> bool:
+        """True si el código se ejecuta con un usuario distinto del proceso actual."""
+        return self.uid is not None and self.uid != os.getuid()
+    
+    def _grant_sandbox_read(self, path: str) -> None:
+        """
+        Da al usuario sandbox lectura (no escritura) sobre el archivo del DataFrame:
+        grupo del usuario sandbox y modo 0640. El proceso sandbox adopta ese grupo al bajar privilegios.
+        """
+        if not self._drops_privileges():
+            return
+        os.chown(path, -1, self.gid)
+        os.chmod(path, 0o640)
+    
+    def _schedule_cleanup(self) -> None:
+        """Lanza la limpieza de temporales en segundo plano, como máximo una vez por intervalo."""
+        now = time.monotonic()
+        for directory in {self.temp_dir, self.data_dir}:
+            key = str(directory)
+            with _CLEANUP_LOCK:
+                last = _LAST_CLEANUP.get(key)
+                if last is not None and now - last < self.CLEANUP_INTERVAL:
+                    continue
+                _LAST_CLEANUP[key] = now
+            
+            threading.Thread(
+                target=self._cleanup_old_files, args=(directory,), name="sandbox-cleanup", daemon=True
+            ).start()
+    
+    def _cleanup_old_files(self, directory: Path) -> None:
         """Limpia archivos temporales antiguos del sandbox."""
         try:
-            import time
-            current_time = time.time()
+            key = str(directory)
+            now = time.time()
+            cutoff = now - self.TEMP_FILE_MAX_AGE
+            
+            # Si el directorio no cambió y ningún archivo ha caducado aún, no hace falta escanear
+            dir_mtime = os.stat(directory).st_mtime_ns
+            snapshot = _CLEANUP_SNAPSHOT.get(key)
+            if snapshot is not None and snapshot[0] == dir_mtime and now < snapshot[1]:
+                return
+            
+            oldest_survivor = float('inf')
             
-            # Eliminar archivos más antiguos de 1 hora
-            for file_path in self.temp_dir.glob("*"):
-                if file_path.is_file():
-                    file_age = current_time - file_path.stat().st_mtime
-                    if file_age > 3600:  # 1 hora
-                        try:
-                            file_path.unlink()
-                            logger.debug(f"Archivo temporal antiguo eliminado: {file_path.name}")
-                        except:
-                            pass  # Ignorar errores de limpieza
+            # scandir reutiliza el tipo de entrada del directorio: un solo stat por archivo
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+                        mtime = entry.stat().st_mtime
+                        if mtime < cutoff:
+                            os.unlink(entry.path)
+                            logger.debug(f"Archivo temporal antiguo eliminado: {entry.name}")
+                        else:
+                            oldest_survivor = min(oldest_survivor, mtime)
+                    except OSError:
+                        pass  # Ignorar errores de limpieza
+            
+            # Si se borró algo el mtime del directorio cambia y la próxima pasada vuelve a escanear
+            _CLEANUP_SNAPSHOT[key] = (dir_mtime, oldest_survivor + self.TEMP_FILE_MAX_AGE)
         except Exception as e:
             logger.debug(f"Error en limpieza automática: {e}")
     
@@ -125,10 +376,34 @@ class SandboxExecutor:
             df: DataFrame a inyectar
         """
         try:
-            # Crear archivo pickle temporal para el DataFrame
-            with tempfile.NamedTemporaryFile(mode='wb', delete=False, suffix='.pkl', dir=self.temp_dir) as tmp_file:
-                pickle.dump(df, tmp_file)
-                self._injected_dataframe_path = tmp_file.name
+            # Mismo contenido que el DataFrame ya inyectado: no hace falta reescribirlo
+            fingerprint = self._dataframe_fingerprint(df)
+            if (fingerprint is not None and fingerprint == self._df_fingerprint
+                    and self._injected_dataframe_path and os.path.exists(self._injected_dataframe_path)):
+                logger.debug("DataFrame sin cambios respecto al inyectado, se reutiliza")
+                return
+            
+            previous_path = self._injected_dataframe_path
+            
+            try:
+                path = self._write_dataframe_file(df, self.data_dir)
+            except OSError as e:
+                # /dev/shm lleno o inaccesible: temp_dir en disco para esta y las siguientes
+                if self.data_dir == self.temp_dir:
+                    raise
+                logger.warning(f"No se pudo escribir el DataFrame en {self.data_dir} ({e}), usando {self.temp_dir}")
+                self.data_dir = self.temp_dir
+                path = self._write_dataframe_file(df, self.data_dir)
+            self._injected_dataframe_path = path
+            self._df_fingerprint = fingerprint
+            self._setup_bytes = self._build_setup_bytes()
+            
+            # El archivo anterior ya no se usa (en /dev/shm ocuparía RAM hasta la limpieza)
+            if previous_path:
+                try:
+                    os.unlink(previous_path)
+                except OSError:
+                    pass
             
             logger.debug(f"DataFrame inyectado exitosamente: {df.shape[0]} filas, {df.shape[1]} columnas")
             
@@ -136,16 +411,144 @@ class SandboxExecutor:
             logger.error(f"Error inyectando DataFrame: {e}")
             raise
     
+    @staticmethod
+    def _dataframe_fingerprint(df: pd.DataFrame) -> Optional[bytes]:
+        """
+        Huella del contenido del DataFrame (valores, índice, columnas y dtypes).
+        Usa el hash vectorizado de pandas, mucho más barato que serializar.
+        
+        Returns:
+            Optional[bytes]: Huella, o None si hay valores no hasheables (p. ej. listas)
+        """
+        try:
+            row_hashes = pd.util.hash_pandas_object(df, index=True).to_numpy()
+        except TypeError:
+            return None
+        
+        h = hashlib.blake2b(digest_size=16)
+        h.update(row_hashes.tobytes())
+        h.update(repr(list(df.columns)).encode('utf-8'))
+        h.update(repr(list(df.dtypes.astype(str))).encode('utf-8'))
+        return h.digest()
+    
+    def _write_dataframe_file(self, df: pd.DataFrame, directory: Path) -> str:
+        """
+        Escribe el DataFrame en `directory`: Arrow IPC (lectura por memory map) o pickle como fallback.
+        Si la escritura falla no deja archivos a medias.
+        
+        Returns:
+            str: Ruta del archivo escrito
+        """
+        path = self._write_arrow_file(df, directory)
+        if path is None:
+            fd, path = tempfile.mkstemp(suffix='.pkl', dir=directory)
+            try:
+                with os.fdopen(fd, 'wb') as tmp_file:
+                    pickle.dump(df, tmp_file)
+            except BaseException:
+                os.unlink(path)
+                raise
+        
+        try:
+            self._grant_sandbox_read(path)
+        except OSError:
+            os.unlink(path)
+            raise
+        return path
+    
+    def _write_arrow_file(self, df: pd.DataFrame, directory: Path) -> Optional[str]:
+        """
+        Escribe el DataFrame como archivo Arrow IPC en `directory`.
+        
+        Returns:
+            Optional[str]: Ruta del archivo, o None si pyarrow no está disponible
+            o el DataFrame no es convertible (p. ej. columnas object mixtas)
+        """
+        if pa is None:
+            return None
+        
+        # Arrow convierte a texto los nombres de columna no str (2024 -> '2024') con solo un aviso
+        if not all(isinstance(col, str) for col in df.columns):
+            logger.debug("Nombres de columna no textuales, usando pickle")
+            return None
+        
+        try:
+            table = pa.Table.from_pandas(df)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+            logger.debug(f"DataFrame no convertible a Arrow, usando pickle: {e}")
+            return None
+        
+        fd, path = tempfile.mkstemp(suffix='.arrow', dir=directory)
+        os.close(fd)
+        try:
+            with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        except BaseException:
+            os.unlink(path)
+            raise
+        return path
+    
     def clear_injected_dataframe(self) -> None:
         """Limpia el DataFrame inyectado."""
         if self._injected_dataframe_path and os.path.exists(self._injected_dataframe_path):
             try:
                 os.unlink(self._injected_dataframe_path)
                 self._injected_dataframe_path = None
+                self._df_fingerprint = None
+                self._setup_bytes = self._build_setup_bytes()
                 logger.debug("DataFrame inyectado limpiado")
             except Exception as e:
                 logger.warning(f"Error limpiando DataFrame inyectado: {e}")
     
+    def _build_child_env(self) -> Dict[str, str]:
+        """
+        Construye una sola vez el entorno de los subprocesos del sandbox.
+        
+        Returns:
+            Dict[str, str]: Copia de os.environ ajustada según el SO
+        """
+        # Configurar entorno limpio para evitar conflictos con uvicorn
+        env = os.environ.copy()
+        if self.is_windows:
+            # Configuración robusta para Windows con manejo correcto de UTF-8
+            env['PYTHONIOENCODING'] = 'utf-8'
+            env['PYTHONUNBUFFERED'] = '1'
+            env['PYTHONUTF8'] = '1'
+            env['LC_ALL'] = 'es_ES.UTF-8'
+            env['LANG'] = 'es_ES.UTF-8'
+            # Evitar conflictos con el reloader de uvicorn
+            env.pop('UVICORN_RELOAD', None)
+            env.pop('UVICORN_RELOAD_DIRS', None)
+        return env
+    
+    def _get_limits_code(self) -> str:
+        """
+        Genera el stub que aplica usuario y límites dentro del propio subproceso.
+        Al no usar preexec_fn, subprocess puede lanzar con vfork/posix_spawn
+        en lugar de fork, sin copiar las tablas de páginas del proceso padre.
+        
+        Returns:
+            str: Código del stub (vacío en Windows)
+        """
+        if self.is_windows:
+            return ""
+        
+        lines = ["import os as _os", "import resource as _resource"]
+        if self.uid is not None:
+            # Grupo del usuario sandbox (lectura del DataFrame) y sin grupos heredados del padre
+            if self._drops_privileges():
+                lines.append("_os.setgroups([])")
+                lines.append(f"_os.setgid({self.gid})")
+            lines.append(f"_os.setuid({self.uid})")
+        lines.append(f"_resource.setrlimit(_resource.RLIMIT_CPU, ({self.cpu_time}, {self.cpu_time}))")
+        lines.append(f"_resource.setrlimit(_resource.RLIMIT_AS, ({self.memory_bytes}, {self.memory_bytes}))")
+        lines.append("del _os, _resource")
+        return "\n".join(lines) + "\n"
+    
+    def _build_setup_bytes(self) -> bytes:
+        """Precalcula el prefijo (límites + setup) que se antepone al código en modo subproceso."""
+        return (self._get_limits_code() + self._get_setup_code()).encode('utf-8') + b"\n"
+    
     def _get_setup_code(self) -> str:
         """
         Genera el código de setup que carga el DataFrame inyectado.
@@ -160,6 +563,19 @@ import numpy as np
 from datetime import datetime
 """
         
+        if self._injected_dataframe_path.endswith('.arrow'):
+            return f"""
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.ipc
+from datetime import datetime
+
+# Cargar DataFrame pre-inyectado (Arrow IPC mapeado en memoria)
+with pa.memory_map(r'{self._injected_dataframe_path}', 'r') as source:
+    df = pa.ipc.open_file(source).read_all().to_pandas(split_blocks=True)
+"""
+        
         return f"""
 import pandas as pd
 import numpy as np
@@ -171,135 +587,170 @@ with open(r'{self._injected_dataframe_path}', 'rb') as f:
     df = pickle.load(f)
 """
     
-    def _validate_imports(self, code: str) -> None:
+    def validate_code(self, code: str) -> bool:
         """
-        Valida que el código solo use imports permitidos.
+        Ejecuta todas las validaciones de seguridad en el código.
         
         Args:
             code: Código Python a validar
             
-        Raises:
-            SecurityError: Si se detectan imports no permitidos
-        """
-        # Buscar imports con regex (método rápido)
-        import_patterns = [
-            r'^\s*import\s+([a-zA-Z_][a-zA-Z0-9_\.]*)',
-            r'^\s*from\s+([a-zA-Z_][a-zA-Z0-9_\.]*)\s+import',
-        ]
-        
-        found_imports = set()
-        
-        for line in code.split('\n'):
-            for pattern in import_patterns:
-                match = re.match(pattern, line)
-                if match:
-                    module = match.group(1).split('.')[0]  # Solo el módulo principal
-                    found_imports.add(module)
-        
-        # Verificar imports prohibidos explícitamente
-        forbidden_found = found_imports.intersection(self.FORBIDDEN_IMPORTS)
-        if forbidden_found:
-            raise SecurityError(f"Imports prohibidos detectados: {', '.join(forbidden_found)}")
-        
-        # Verificar que solo use imports permitidos
-        not_allowed = found_imports - self.ALLOWED_IMPORTS
-        if not_allowed:
-            raise SecurityError(f"Imports no permitidos: {', '.join(not_allowed)}. "
-                              f"Permitidos: {', '.join(sorted(self.ALLOWED_IMPORTS))}")
-        
-        logger.debug(f"Imports validados: {', '.join(found_imports)}")
-
-    def _validate_functions(self, code: str) -> None:
-        """
-        Valida que el código no use funciones peligrosas.
-        
-        Args:
-            code: Código Python a validar
+        Returns:
+            bool: True si la salida del código es determinista (se puede cachear)
             
         Raises:
-            SecurityError: Si se detectan funciones peligrosas
-        """
-        # Buscar funciones peligrosas
-        for func in self.FORBIDDEN_FUNCTIONS:
-            # Buscar llamadas a la función
-            pattern = rf'\b{re.escape(func)}\s*\('
-            if re.search(pattern, code):
-                raise SecurityError(f"Función prohibida detectada: {func}()")
-        
-        # Verificar patrones peligrosos adicionales
-        dangerous_patterns = [
-            (r'__.*__', "Uso de métodos dunder prohibido"),
-            (r'\.system\s*\(', "Llamada a system() prohibida"),
-            (r'\.popen\s*\(', "Llamada a popen() prohibida"),
-            (r'\.call\s*\(', "Llamada a call() prohibida"),
-        ]
-        
-        for pattern, message in dangerous_patterns:
-            if re.search(pattern, code):
-                raise SecurityError(message)
-        
-        logger.debug("Validación de funciones completada")
-
-    def _validate_ast(self, code: str) -> None:
+            SecurityError: Si el código no pasa las validaciones
         """
-        Validación adicional usando AST (Abstract Syntax Tree).
+        # Código ya validado: reutilizar el resultado (caché LRU acotada)
+        digest = self._code_digest(code)
+        deterministic = self._validated.pop(digest, None)
+        if deterministic is not None:
+            self._validated[digest] = deterministic
+            logger.debug("Código ya validado previamente, omitiendo validación")
+            return deterministic
+        
+        logger.debug("Iniciando validación de seguridad del código")
         
-        Args:
-            code: Código Python a validar
-            
-        Raises:
-            SecurityError: Si se detectan patrones peligrosos
-        """
         try:
             tree = ast.parse(code)
         except SyntaxError as e:
             raise SecurityError(f"Error de sintaxis en el código: {e}")
         
-        # Verificar nodos peligrosos
-        for node in ast.walk(tree):
-            # Prohibir llamadas a exec/eval
-            if isinstance(node, ast.Call):
-                if isinstance(node.func, ast.Name):
-                    if node.func.id in self.FORBIDDEN_FUNCTIONS:
-                        raise SecurityError(f"Llamada prohibida detectada: {node.func.id}")
-            
-            # Prohibir acceso a atributos privados
-            if isinstance(node, ast.Attribute):
-                if node.attr.startswith('_'):
-                    raise SecurityError(f"Acceso a atributo privado prohibido: {node.attr}")
-        
-        logger.debug("Validación AST completada")
-
-    def validate_code(self, code: str) -> None:
-        """
-        Ejecuta todas las validaciones de seguridad en el código.
-        
-        Args:
-            code: Código Python a validar
-            
-        Raises:
-            SecurityError: Si el código no pasa las validaciones
-        """
-        logger.debug("Iniciando validación de seguridad del código")
+        # Un único recorrido del AST recoge imports, llamadas y atributos
+        visitor = _SecurityVisitor(self.FORBIDDEN_FUNCTIONS)
+        visitor.visit(tree)
         
         # 1. Validar imports
-        self._validate_imports(code)
+        forbidden_found = self.FORBIDDEN_IMPORTS & visitor.imports
+        if forbidden_found:
+            raise SecurityError(f"Imports prohibidos detectados: {', '.join(forbidden_found)}")
         
-        # 2. Validar funciones
-        self._validate_functions(code)
+        not_allowed = visitor.imports - self.ALLOWED_IMPORTS
+        if not_allowed:
+            raise SecurityError(f"Imports no permitidos: {', '.join(not_allowed)}. "
+                              f"Permitidos: {', '.join(sorted(self.ALLOWED_IMPORTS))}")
         
-        # 3. Validar AST
-        self._validate_ast(code)
+        # 2. Validar funciones y atributos
+        if visitor.violation:
+            raise SecurityError(visitor.violation)
+        
+        self._validated[digest] = visitor.deterministic
+        if len(self._validated) > self.VALIDATION_CACHE_SIZE:
+            self._validated.popitem(last=False)
         
         logger.info("✅ Código validado exitosamente - sin amenazas detectadas")
+        return visitor.deterministic
+
+    @staticmethod
+    def _code_digest(code: str) -> bytes:
+        """Huella del código usada como clave de las cachés de validación y resultados."""
+        return hashlib.blake2b(code.encode('utf-8'), digest_size=16).digest()
+
+    def _start_worker(self) -> None:
+        """Arranca el worker persistente conectado por un socket heredado."""
+        parent_sock, child_sock = socket.socketpair()
+        try:
+            self._worker = subprocess.Popen(
+                [
+                    sys.executable, '-u', str(WORKER_SCRIPT),
+                    str(child_sock.fileno()),
+                    str(self.memory_bytes),
+                    str(self.uid if self.uid is not None else -1),
+                    str(self.gid if self._drops_privileges() else -1)
+                ],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                pass_fds=(child_sock.fileno(),)
+            )
+        except Exception:
+            parent_sock.close()
+            raise
+        finally:
+            child_sock.close()
+        
+        self._worker_conn = Connection(parent_sock.detach())
+        self._worker_loaded = False
+        self._worker_calls = 0
+        logger.debug(f"Worker del sandbox iniciado (PID: {self._worker.pid})")
+
+    def _stop_worker(self) -> None:
+        """Detiene el worker persistente si está en ejecución."""
+        if self._worker_conn is not None:
+            self._worker_conn.close()
+            self._worker_conn = None
+        if self._worker is None:
+            return
+        try:
+            self._worker.kill()
+            self._worker.wait(timeout=1)
+        except Exception:
+            pass
+        self._worker = None
+        self._worker_loaded = False
 
-    def _preexec_unix(self):
-        """Configuración previa a la ejecución en sistemas Unix."""
-        if not self.is_windows and 'resource' in globals() and 'pwd' in globals():
-            if self.uid is not None:
-                os.setuid(self.uid) # type: ignore
-            resource.setrlimit(resource.RLIMIT_CPU, (self.cpu_time, self.cpu_time)) # type: ignore
-            resource.setrlimit(resource.RLIMIT_AS, (self.memory_bytes, self.memory_bytes)) # type: ignore
+    def close(self) -> None:
+        """Libera el worker persistente."""
+        with self._worker_lock:
+            self._stop_worker()
+
+    def _worker_request(self, message: dict, timeout: float) -> dict:
+        """Envía una petición al worker y espera su respuesta."""
+        self._worker_conn.send_bytes(dumps_bytes(message)) # type: ignore
+        if not self._worker_conn.poll(timeout): # type: ignore
+            raise subprocess.TimeoutExpired(str(WORKER_SCRIPT), timeout)
+        return loads_bytes(self._worker_conn.recv_bytes()) # type: ignore
+
+    def _execute_in_worker(self, code: str, timeout: int):
+        """
+        Ejecuta código en el worker persistente, arrancándolo si es necesario.
+        Ante timeout, caída o tras WORKER_MAX_CALLS ejecuciones, el worker se descarta
+        y se relanza en la siguiente consulta.
+        """
+        with self._worker_lock:
+            try:
+                if self._worker is None or self._worker.poll() is not None:
+                    self._start_worker()
+                
+                # Sincronizar el DataFrame inyectado con el worker
+                if not self._worker_loaded or self._worker_df_path != self._injected_dataframe_path:
+                    reply = self._worker_request(
+                        {"op": "load", "path": self._injected_dataframe_path},
+                        self.WORKER_STARTUP_TIMEOUT
+                    )
+                    if not reply.get("ok"):
+                        raise RuntimeError(reply.get("error"))
+                    self._worker_df_path = self._injected_dataframe_path
+                    self._worker_loaded = True
+                
+                logger.debug("Ejecutando código validado en worker persistente")
+                reply = self._worker_request(
+                    {"op": "exec", "code": code, "cpu_time": self.cpu_time},
+                    timeout
+                )
+                
+                # Reciclar el worker periódicamente para acotar fugas de memoria o estado
+                self._worker_calls += 1
+                if self._worker_calls >= self.WORKER_MAX_CALLS:
+                    logger.debug(f"Reciclando worker del sandbox tras {self._worker_calls} ejecuciones")
+                    self._stop_worker()
+                
+                return reply["stdout"], reply["stderr"]
+                
+            except subprocess.TimeoutExpired:
+                self._stop_worker()
+                error_msg = f"Timeout después de {timeout} segundos"
+                logger.error(error_msg)
+                return "", error_msg
+            except EOFError:
+                self._stop_worker()
+                error_msg = "Error ejecutando código: el proceso del sandbox terminó inesperadamente (límite de CPU o memoria excedido)"
+                logger.error(error_msg)
+                return "", error_msg
+            except Exception as e:
+                self._stop_worker()
+                error_msg = f"Error ejecutando código: {str(e)}"
+                logger.error(error_msg)
+                return "", error_msg
 
     def execute_code(self, code: str, timeout: int = 5):
         """
@@ -311,62 +762,92 @@ with open(r'{self._injected_dataframe_path}', 'rb') as f:
             timeout: Tiempo límite en segundos
             
         Returns:
-            tuple: (stdout, stderr)
+            tuple: (stdout, stderr); last_deterministic indica si la salida es memorizable
         """
+        self.last_deterministic = False
+        
+        # Nada que ejecutar
+        if not code.strip():
+            return "", ""
+        
         # VALIDACIÓN DE SEGURIDAD ANTES DE EJECUTAR
         try:
-            self.validate_code(code)
+            deterministic = self.last_deterministic = self.validate_code(code)
         except SecurityError as e:
             error_msg = f"🛡️ CÓDIGO RECHAZADO POR SEGURIDAD: {str(e)}"
             logger.error(error_msg)
             return "", error_msg
         
-        # Crear archivo temporal en el directorio configurado
-        script_path = self.temp_dir / f"script_{os.getpid()}.py"
+        # Mismo código sobre el mismo DataFrame inyectado: reutilizar la salida.
+        # La huella de contenido sobrevive a re-inyecciones de los mismos datos;
+        # si no se pudo calcular, se usa la ruta del archivo inyectado
+        result_key = (self._code_digest(code), self._df_fingerprint or self._injected_dataframe_path)
+        if deterministic:
+            cached = self._results.pop(result_key, None)
+            if cached is not None:
+                self._results[result_key] = cached
+                logger.debug("Resultado obtenido de la caché de ejecuciones")
+                return cached
+        
+        if self.use_worker:
+            stdout, stderr = self._execute_in_worker(code, timeout)
+        else:
+            stdout, stderr = self._execute_subprocess(code, timeout)
         
+        # Solo se recuerdan ejecuciones completadas sin errores
+        if deterministic and not stderr:
+            self._results[result_key] = (stdout, stderr)
+            if len(self._results) > self.RESULT_CACHE_SIZE:
+                self._results.popitem(last=False)
+        
+        return stdout, stderr
+
+    def _execute_subprocess(self, code: str, timeout: int):
+        """
+        Ejecuta código ya validado en un subproceso nuevo (modo sin worker persistente).
+        
+        Args:
+            code: Código Python a ejecutar
+            timeout: Tiempo límite en segundos
+            
+        Returns:
+            tuple: (stdout, stderr)
+        """
         try:
-            # Escribir código al archivo
-            setup_code = self._get_setup_code()
-            full_code = f"{setup_code}\n{code}"
-            script_path.write_text(full_code, encoding='utf-8')
+            # El código se pasa por stdin: sin archivo temporal que escribir y borrar
+            # El prefijo de setup se precalcula en bytes al inyectar el DataFrame
+            full_code = self._setup_bytes + code.encode('utf-8')
             
             # Preparar comando y configuración según el SO
             # Usar el Python del entorno virtual actual
             python_executable = sys.executable
-            cmd = [python_executable, str(script_path)]
-            preexec_fn = None if self.is_windows else self._preexec_unix
+            cmd = [python_executable, '-']
             
-            # Configurar entorno limpio para evitar conflictos con uvicorn
-            env = os.environ.copy()
-            if self.is_windows:
-                # Configuración robusta para Windows con manejo correcto de UTF-8
-                env['PYTHONIOENCODING'] = 'utf-8'
-                env['PYTHONUNBUFFERED'] = '1'
-                env['PYTHONUTF8'] = '1'
-                env['LC_ALL'] = 'es_ES.UTF-8'
-                env['LANG'] = 'es_ES.UTF-8'
-                # Evitar conflictos con el reloader de uvicorn
-                env.pop('UVICORN_RELOAD', None)
-                env.pop('UVICORN_RELOAD_DIRS', None)
-            
-            logger.debug(f"Ejecutando código validado en {script_path}")
+            logger.debug("Ejecutando código validado en subproceso")
             
             result = subprocess.run(
                 cmd,
                 capture_output=True,
-                text=True,
-                encoding='utf-8',
-                errors='replace',
                 timeout=timeout,
-                preexec_fn=preexec_fn,
-                env=env,
-                stdin=subprocess.DEVNULL,
+                env=self._child_env,
+                input=full_code,
                 # Crear un grupo de procesos separado en Windows
                 creationflags=subprocess.CREATE_NEW_PROCESS_GROUP if self.is_windows else 0
             )
             
             logger.debug(f"Ejecución completada. Código de salida: {result.returncode}")
-            return result.stdout, result.stderr
+            stdout = result.stdout.decode('utf-8', errors='replace')
+            stderr = result.stderr.decode('utf-8', errors='replace')
+            
+            # Un proceso terminado por señal (p. ej. SIGXCPU por el límite de CPU) o con
+            # código distinto de 0 no es un resultado válido aunque no haya escrito en stderr
+            if result.returncode != 0 and not stderr:
+                if result.returncode < 0:
+                    stderr = f"Proceso terminado por la señal {-result.returncode} (límite de CPU o memoria excedido)"
+                else:
+                    stderr = f"Proceso terminado con código de salida {result.returncode}"
+                logger.error(stderr)
+            return stdout, stderr
             
         except subprocess.TimeoutExpired:
             error_msg = f"Timeout después de {timeout} segundos"
@@ -375,8 +856,4 @@ with open(r'{self._injected_dataframe_path}', 'rb') as f:
         except Exception as e:
             error_msg = f"Error ejecutando código: {str(e)}"
             logger.error(error_msg)
-            return "", error_msg
-        finally:
-            # Limpiar archivo temporal
-            if script_path.exists():
-                script_path.unlink()
\ No newline at end of file
+            return "", error_msg
\ No newline at end of file
@@ -0,0 +1,192 @@
+"""
+Worker persistente del sandbox.
+
+Se lanza una sola vez como subproceso
+(``python -u sandbox_worker.py <fd> <memory_bytes> <uid> <gid>``) y atiende peticiones de ejecución por un socket heredado del proceso padre,
+envuelto en ``multiprocessing.connection.Connection`` (mensajes con prefijo
+de longitud gestionados por send_bytes/recv_bytes; cuerpo JSON UTF-8).
+
+Peticiones:
+    {"op": "load", "path": "<archivo .arrow o .pkl del DataFrame>" | null}
+    {"op": "exec", "code": "<código>", "cpu_time": <segundos>}
+
+Respuestas:
+    {"ok": true} | {"ok": false, "error": "<mensaje>"}
+    {"stdout": "<salida>", "stderr": "<errores>"}
+
+No importa módulos del proyecto. Aplica el usuario y el límite de memoria
+del sandbox al arrancar, antes de importar pandas o ejecutar código
+(uid/gid -1 = mantener el usuario/grupo actual).
+"""
+
+import contextlib
+import io
+import json
+import os
+import sys
+import traceback
+import warnings
+from multiprocessing.connection import Connection
+from typing import Any, Dict
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def _reply(conn: Connection, message: Dict[str, Any]) -> None:
+    """Envía una respuesta JSON al proceso padre."""
+    conn.send_bytes(json.dumps(message).encode('utf-8'))
+
+def _load_dataframe(path: str):
+    """Carga el DataFrame inyectado (Arrow IPC mapeado en memoria o pickle)."""
+    if path.endswith('.arrow'):
+        import pyarrow as pa
+        import pyarrow.ipc
+        with pa.memory_map(path, 'r') as source:
+            # split_blocks evita consolidar columnas en bloques 2D (una copia menos)
+            return pa.ipc.open_file(source).read_all().to_pandas(split_blocks=True)
+    
+    import pickle
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def _set_cpu_budget(seconds: int) -> None:
+    """Permite `seconds` de CPU adicionales a partir del consumo actual del worker."""
+    if resource is None or not seconds:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = int(usage.ru_utime + usage.ru_stime) + 1
+    soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    limit = used + seconds
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (limit, hard))
+
+def _option_items(options, prefix: str = ''):
+    """Recorre pd.options y devuelve pares (clave completa, valor): ('display.max_rows', 60)..."""
+    for name in dir(options):
+        value = getattr(options, name)
+        if isinstance(value, type(options)):
+            yield from _option_items(value, f"{prefix}{name}.")
+        else:
+            yield f"{prefix}{name}", value
+
+def _snapshot_module_state(pd, np) -> tuple:
+    """Captura las opciones globales de pandas y numpy recién importados."""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # opciones obsoletas avisan al leerlas
+        options = dict(_option_items(pd.options))
+    return options, np.geterr(), np.get_printoptions()
+
+def _restore_module_state(pd, np, snapshot: tuple) -> None:
+    """
+    Devuelve pandas y numpy al estado inicial: una ejecución que cambie
+    pd.set_option o np.set_printoptions no afecta a las siguientes.
+    Solo se reescriben las opciones modificadas (set_option dispara callbacks).
+    """
+    options, np_err, np_print = snapshot
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for key, value in options.items():
+            if pd.get_option(key) != value:
+                pd.set_option(key, value)
+    np.seterr(**np_err)
+    np.set_printoptions(**np_print)
+
+def _enable_copy_on_write(pd) -> bool:
+    """
+    Activa copy-on-write (por defecto desde pandas 3, opción desde pandas 2).
+    Con él, df.copy(deep=False) solo duplica las columnas que el código modifica.
+    
+    Returns:
+        bool: True si copy-on-write está activo
+    """
+    if int(pd.__version__.split('.')[0]) >= 3:
+        return True
+    if int(pd.__version__.split('.')[0]) < 2:
+        return False
+    pd.set_option('mode.copy_on_write', True)
+    return True
+
+def _copy_on_write_active(pd) -> bool:
+    """Comprueba que el código ejecutado no haya desactivado copy-on-write (pandas 2)."""
+    if int(pd.__version__.split('.')[0]) >= 3:
+        return True
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return pd.get_option('mode.copy_on_write') is True
+
+def _drop_privileges(memory_bytes: int, uid: int, gid: int) -> None:
+    """Aplica usuario, grupo y límite de memoria del sandbox (el de CPU se fija por consulta)."""
+    if resource is None:
+        return
+    if gid >= 0:
+        # El grupo del usuario sandbox da lectura al DataFrame; sin grupos heredados del padre
+        os.setgroups([])
+        os.setgid(gid)
+    if uid >= 0:
+        os.setuid(uid)
+    resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+
+def main() -> None:
+    conn = Connection(int(sys.argv[1]))
+    _drop_privileges(int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]))
+
+    # Imports pesados una única vez por proceso
+    import numpy as np
+    import pandas as pd
+    from datetime import datetime
+    copy_on_write = _enable_copy_on_write(pd)
+    initial_state = _snapshot_module_state(pd, np)
+
+    df = None
+    df_path = None
+
+    while True:
+        try:
+            request = json.loads(conn.recv_bytes())
+        except EOFError:
+            break
+
+        if request.get('op') == 'load':
+            try:
+                df_path = request.get('path')
+                df = _load_dataframe(df_path) if df_path else None
+                _reply(conn, {"ok": True})
+            except Exception as e:
+                df = None
+                _reply(conn, {"ok": False, "error": str(e)})
+            continue
+
+        # Espacio de nombres y módulos limpios en cada ejecución (mismo entorno que el setup clásico)
+        _restore_module_state(pd, np, initial_state)
+        namespace = {'__name__': '__main__', 'pd': pd, 'np': np, 'datetime': datetime}
+        if df is not None:
+            # Con copy-on-write basta una copia superficial: no duplica el DataFrame en cada consulta
+            # (importante bajo el límite RLIMIT_AS); sin él, copia completa
+            namespace['df'] = df.copy(deep=False) if copy_on_write else df.copy()
+
+        out, err = io.StringIO(), io.StringIO()
+        _set_cpu_budget(request.get('cpu_time', 0))
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            try:
+                exec(compile(request.get('code', ''), '<sandbox>', 'exec'), namespace)
+            except SystemExit:
+                pass
+            except BaseException as e:
+                # Omitir el frame del propio worker en el traceback
+                traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+
+        # Si el código desactivó copy-on-write pudo modificar el DataFrame compartido: se recarga
+        if copy_on_write and df is not None and not _copy_on_write_active(pd):
+            del namespace
+            try:
+                df = _load_dataframe(df_path)
+            except Exception:
+                df = None
+
+        _reply(conn, {"stdout": out.getvalue(), "stderr": err.getvalue()})
+
+if __name__ == '__main__':
+    main()
@@ -37,40 +37,12 @@ class MultiSheetHandler:
         try:
             logger.info(f"Analizando hojas del archivo: {self.excel_path}")
             
-            # Obtener nombres de todas las hojas
-            excel_file = pd.ExcelFile(self.excel_path)
-            sheet_names = excel_file.sheet_names
-            
             sheets_info = {}
             
-            for sheet_name in sheet_names:
-                try:
-                    # Leer solo las primeras filas para obtener info básica
-                    df_sample = pd.read_excel(self.excel_path, sheet_name=sheet_name, nrows=5)
-                    
-                    # Leer toda la hoja para obtener el conteo real de filas
-                    df_full = pd.read_excel(self.excel_path, sheet_name=sheet_name)
-                    
-                    sheets_info[sheet_name] = {
-                        'rows': len(df_full),
-                        'columns': len(df_full.columns),
-                        'column_names': df_full.columns.tolist(),
-                        'sample_data': df_sample.head(3).to_dict('records') if not df_sample.empty else [],
-                        'is_empty': df_full.empty
-                    }
-                    
-                    logger.debug(f"Hoja '{sheet_name}': {len(df_full)} filas, {len(df_full.columns)} columnas")
-                    
-                except Exception as e:
-                    logger.warning(f"Error leyendo hoja '{sheet_name}': {e}")
-                    sheets_info[sheet_name] = {
-                        'rows': 0,
-                        'columns': 0,
-                        'column_names': [],
-                        'sample_data': [],
-                        'is_empty': True,
-                        'error': str(e)
-                    }
+            # Abrir el libro una sola vez y leer cada hoja una única vez
+            with pd.ExcelFile(self.excel_path) as excel_file:
+                for sheet_name in excel_file.sheet_names:
+                    sheets_info[sheet_name] = self._read_sheet_info(excel_file, sheet_name)
             
             self._sheets_info = sheets_info
             logger.info(f"Análisis completado: {len(sheets_info)} hojas encontradas")
@@ -80,6 +52,33 @@ class MultiSheetHandler:
             logger.error(f"Error analizando archivo Excel: {e}")
             raise ValueError(f"Error al analizar el archivo Excel: {e}")
     
+    @staticmethod
+    def _read_sheet_info(excel_file: pd.ExcelFile, sheet_name: str) -> Dict:
+        """Lee una hoja completa y extrae dimensiones, columnas y muestra."""
+        try:
+            # La hoja completa da el conteo real de filas; la muestra sale del mismo DataFrame
+            df = excel_file.parse(sheet_name)
+            
+            logger.debug(f"Hoja '{sheet_name}': {len(df)} filas, {len(df.columns)} columnas")
+            return {
+                'rows': len(df),
+                'columns': len(df.columns),
+                'column_names': df.columns.tolist(),
+                'sample_data': df.head(3).to_dict('records') if not df.empty else [],
+                'is_empty': df.empty
+            }
+            
+        except Exception as e:
+            logger.warning(f"Error leyendo hoja '{sheet_name}': {e}")
+            return {
+                'rows': 0,
+                'columns': 0,
+                'column_names': [],
+                'sample_data': [],
+                'is_empty': True,
+                'error': str(e)
+            }
+    
     def has_multiple_sheets(self) -> bool:
         """Verifica si el archivo tiene múltiples hojas."""
         sheets_info = self.get_sheets_info()
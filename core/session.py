@@ -5,6 +5,13 @@ Contiene toda la lógica para el modo conversacional con comandos especiales.
 from pathlib import Path
 from core.client_manager import ClientManager, ClientConfig
 
+# Comandos especiales (comparados en minúsculas)
+EXIT_COMMANDS = frozenset({'salir', 'exit', 'quit', 'q'})
+HELP_COMMANDS = frozenset({'ayuda', 'help', 'h'})
+CHANGE_FILE_COMMANDS = frozenset({'cambiar archivo', 'cambiar', 'archivo'})
+STATS_COMMANDS = frozenset({'stats', 'estadisticas', 'cache'})
+CHANGE_CLIENT_COMMANDS = frozenset({'cambiar cliente', 'cliente', 'config'})
+CLEAR_COMMANDS = frozenset({'clear cache', 'limpiar cache', 'clear'})
 
 class InteractiveSession:
     """Maneja la sesión interactiva del chatbot Excel."""
@@ -85,7 +92,7 @@ class InteractiveSession:
     def process_question(self, excel_path: str, question: str, specific_sheet=None):
         """Procesar una pregunta del usuario."""
         try:
-            self.logger.info(f"Procesando pregunta: {question}")
+            self.logger.info("Procesando pregunta: %s", question)
             result = self.agent.ask(excel_path, question, sheet_name=specific_sheet)
             return result, None
         except Exception as e:
@@ -117,21 +124,21 @@ class InteractiveSession:
         question_lower = question.lower()
         
         # Comando salir
-        if question_lower in ['salir', 'exit', 'quit', 'q']:
+        if question_lower in EXIT_COMMANDS:
             print("👋 ¡Hasta luego!")
             self.logger.info("Sesión terminada por el usuario")
             return 'exit'
         
         # Comando ayuda
-        elif question_lower in ['ayuda', 'help', 'h']:
+        elif question_lower in HELP_COMMANDS:
             self.print_help()
             return 'continue'
         
         # Comando cambiar archivo
-        elif question_lower in ['cambiar archivo', 'cambiar', 'archivo']:
+        elif question_lower in CHANGE_FILE_COMMANDS:
             new_excel_path = self.get_excel_file()
             print(f"📊 Archivo cambiado a: {new_excel_path}")
-            self.logger.info(f"Archivo cambiado a: {new_excel_path}")
+            self.logger.info("Archivo cambiado a: %s", new_excel_path)
             
             # Precargar nuevo archivo
             print(f"🔄 Precargando nuevo DataFrame...")
@@ -142,17 +149,17 @@ class InteractiveSession:
             return ('file_changed', new_excel_path)
         
         # Comando estadísticas
-        elif question_lower in ['stats', 'estadisticas', 'cache']:
+        elif question_lower in STATS_COMMANDS:
             self.show_cache_stats()
             return 'continue'
         
         # Comando cambiar cliente
-        elif question_lower in ['cambiar cliente', 'cliente', 'config']:
+        elif question_lower in CHANGE_CLIENT_COMMANDS:
             self.change_client()
             return 'continue'
         
         # Comando limpiar caché
-        elif question_lower in ['clear cache', 'limpiar cache', 'clear']:
+        elif question_lower in CLEAR_COMMANDS:
             self.agent.clear_cache()
             print("🧹 Caché limpiado exitosamente")
             return 'continue'
@@ -190,22 +197,18 @@ class InteractiveSession:
     
     def validate_excel_file(self, excel_path: str) -> str:
         """Validar y obtener archivo Excel para usar."""
-        # Obtener archivo Excel
+        # Obtener archivo Excel (una sola comprobación en disco)
         if Path(excel_path).exists():
             print(f"📊 Usando archivo: {excel_path}")
             return excel_path
-        else:
-            if excel_path == "data/input/demo.xlsx":
-                # Archivo demo por defecto
-                print(f"📊 Usando archivo demo: {excel_path}")
-                if not Path(excel_path).exists():
-                    print(f"❌ Archivo demo no encontrado: {excel_path}")
-                    return self.get_excel_file()
-            else:
-                print(f"❌ Archivo especificado no encontrado: {excel_path}")
-                return self.get_excel_file()
         
-        return excel_path
+        if excel_path == "data/input/demo.xlsx":
+            # Archivo demo por defecto
+            print(f"📊 Usando archivo demo: {excel_path}")
+            print(f"❌ Archivo demo no encontrado: {excel_path}")
+        else:
+            print(f"❌ Archivo especificado no encontrado: {excel_path}")
+        return self.get_excel_file()
     
     def run(self, excel_path: str, specific_sheet=None):
         """Ejecutar la sesión interactiva."""
@@ -215,7 +218,7 @@ class InteractiveSession:
             
             # Validar archivo Excel
             excel_path = self.validate_excel_file(excel_path)
-            self.logger.info(f"Archivo Excel seleccionado: {excel_path}")
+            self.logger.info("Archivo Excel seleccionado: %s", excel_path)
             
             # Precargar DataFrame
             self.preload_dataframe(excel_path, specific_sheet)
@@ -253,10 +256,10 @@ class InteractiveSession:
                         print("-" * 30)
                         print(result)
                         print("-" * 30)
-                        self.logger.info(f"Pregunta #{self.question_count} procesada exitosamente")
+                        self.logger.info("Pregunta #%d procesada exitosamente", self.question_count)
                     else:
                         print(f"\n❌ Error: {error}")
-                        self.logger.error(f"Error en pregunta #{self.question_count}: {error}")
+                        self.logger.error("Error en pregunta #%d: %s", self.question_count, error)
                     
                 except KeyboardInterrupt:
                     print("\n⚠️ Operación cancelada. Escribe 'salir' para terminar.")
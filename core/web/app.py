@@ -2,28 +2,60 @@
 Aplicación web FastAPI para Excel Chatbot.
 Proporciona una interfaz web moderna que utiliza toda la arquitectura modular existente.
 """
-from fastapi import FastAPI, Request
+from fastapi import Depends, FastAPI, Request
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, JSONResponse
 import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
 
+from config.settings import get_settings
 from core.client_manager import ClientManager
+from core.web.deps import get_client_manager
 from core.web.routes.api import router as api_router
-from core.web.routes.upload import router as upload_router
+from core.web.routes.upload import router as upload_router, MAX_REQUEST_BYTES
+from core.web.middleware import MaxBodySizeMiddleware
+
+try:
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse
+    # Las versiones recientes de FastAPI ya serializan a bytes vía Pydantic y la marcan obsoleta
+    DefaultResponse = JSONResponse if getattr(ORJSONResponse, "__deprecated__", None) else ORJSONResponse
+except ImportError:  # orjson es opcional: se usa el JSON estándar
+    DefaultResponse = JSONResponse
 
 # Configurar paths
 BASE_DIR = Path(__file__).parent.parent.parent
 TEMPLATES_DIR = BASE_DIR / "templates"
 STATIC_DIR = Path(__file__).parent / "static"
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Configura el pool de hilos donde se ejecutan las consultas bloqueantes."""
+    # Un error de configuración (QUERY_WORKERS inválido, falta SANDBOX_TEMP_DIR...) detiene el arranque
+    executor = ThreadPoolExecutor(max_workers=get_settings().query_workers, thread_name_prefix="query")
+    asyncio.get_running_loop().set_default_executor(executor)
+    yield
+    executor.shutdown(wait=False)
+
 app = FastAPI(
     title="Excel Chatbot Web Interface",
     description="Interfaz web moderna para análisis inteligente de Excel",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan,
+    default_response_class=DefaultResponse
 )
 
+# Comprimir respuestas (JSON, HTML, estáticos) a partir de 1 KB
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+# Cortar subidas demasiado grandes antes de que se lean completas
+app.add_middleware(MaxBodySizeMiddleware, max_bytes=MAX_REQUEST_BYTES, path_prefix="/upload")
+
 # Configurar archivos estáticos y templates
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
@@ -32,34 +64,46 @@ templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
 app.include_router(api_router, prefix="/api")
 app.include_router(upload_router, prefix="/upload")
 
-# Instancia global del client manager
-client_manager = ClientManager()
+def _load_client_summary(client_manager: ClientManager, client_id: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Carga el resumen de un cliente para la página principal (None si falla)."""
+    try:
+        config = client_manager.load_client_config(client_id)
+        return client_id, {
+            "name": config.client_name,
+            "description": config.description,
+            "banner_title": config.ui_config.get("banner_title", ""),
+            "banner_subtitle": config.ui_config.get("banner_subtitle", ""),
+            "example_questions": config.ui_config.get("example_questions", [])
+        }
+    except Exception as e:
+        print(f"Error loading client {client_id}: {e}")
+        return client_id, None
+
+async def _build_client_configs(client_manager: ClientManager) -> Dict[str, Dict[str, Any]]:
+    """Carga en paralelo (hilos) las configuraciones de clientes sin bloquear el event loop."""
+    clients = client_manager.list_clients()
+    results = await asyncio.gather(
+        *(asyncio.to_thread(_load_client_summary, client_manager, client_id) for client_id in clients)
+    )
+    return {client_id: summary for client_id, summary in results if summary is not None}
+
+# HTML de la página principal junto a la versión de configuraciones con la que se generó
+_home_cache: Optional[Tuple[int, str]] = None
 
 @app.get("/", response_class=HTMLResponse)
-async def home(request: Request):
+async def home(request: Request, client_manager: ClientManager = Depends(get_client_manager)):
     """Página principal de la aplicación web."""
-    # Obtener lista de clientes disponibles
-    clients = client_manager.list_clients()
-    client_configs = {}
+    global _home_cache
     
-    for client_id in clients:
-        try:
-            config = client_manager.load_client_config(client_id)
-            client_configs[client_id] = {
-                "name": config.client_name,
-                "description": config.description,
-                "banner_title": config.ui_config.get("banner_title", ""),
-                "banner_subtitle": config.ui_config.get("banner_subtitle", ""),
-                "example_questions": config.ui_config.get("example_questions", [])
-            }
-        except Exception as e:
-            print(f"Error loading client {client_id}: {e}")
-            continue
+    # Solo se vuelve a renderizar si cambió alguna configuración de cliente
+    clients_mtime = client_manager.mtime()
+    cached = _home_cache
+    if cached is None or cached[0] != clients_mtime:
+        client_configs = await _build_client_configs(client_manager)
+        html = templates.get_template("index.html").render(clients=client_configs)
+        cached = _home_cache = (clients_mtime, html)
     
-    return templates.TemplateResponse("index.html", {
-        "request": request,
-        "clients": client_configs
-    })
+    return HTMLResponse(cached[1])
 
 @app.get("/health")
 async def health_check():
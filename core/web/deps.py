@@ -0,0 +1,11 @@
+"""
+Dependencias compartidas de la aplicación web (para usar con FastAPI Depends).
+"""
+from functools import lru_cache
+
+from core.client_manager import ClientManager
+
+@lru_cache(maxsize=1)
+def get_client_manager() -> ClientManager:
+    """Devuelve el ClientManager único compartido por todas las rutas web."""
+    return ClientManager()
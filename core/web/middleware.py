@@ -0,0 +1,53 @@
+"""
+Middlewares ASGI de la aplicación web.
+"""
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+class MaxBodySizeMiddleware:
+    """
+    Rechaza con 413 los cuerpos de petición que superan `max_bytes`.
+
+    Comprueba Content-Length antes de despachar la ruta (Starlette guarda
+    el multipart completo antes de llamar al handler) y cuenta los bytes
+    recibidos para cuerpos sin esa cabecera.
+    """
+
+    def __init__(self, app: ASGIApp, max_bytes: int, path_prefix: str = "/"):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_prefix = path_prefix
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        detail = "La petición supera el tamaño máximo permitido"
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None:
+            try:
+                declared = int(content_length)
+            except ValueError:
+                response = JSONResponse({"detail": "Cabecera Content-Length inválida"}, status_code=400)
+                await response(scope, receive, send)
+                return
+            if declared > self.max_bytes:
+                response = JSONResponse({"detail": detail}, status_code=413)
+                await response(scope, receive, send)
+                return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -2,22 +2,29 @@
 Rutas API para el chatbot Excel.
 Maneja las consultas y la interacción con el agente.
 """
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Set, Tuple
 import asyncio
+import hashlib
 import os
-from pathlib import Path
+import time
+from collections import OrderedDict
 
 from core.client_manager import ClientManager, ClientConfig
 from core.agent.base_agent import BaseAgent
 from config.settings import get_settings
+from core.web.deps import get_client_manager
+from utils import dumps_bytes
 
 router = APIRouter()
 
 # Instancias globales
-client_manager = ClientManager()
-current_agents: Dict[str, BaseAgent] = {}  # Cache de agentes por sesión
+# Cache LRU de agentes por cliente: client_id -> (último uso, agente)
+current_agents: "OrderedDict[str, Tuple[float, BaseAgent]]" = OrderedDict()
+_agent_locks: Dict[str, asyncio.Lock] = {}  # Locks de creación por cliente
+_agent_inflight: Dict[BaseAgent, int] = {}  # Consultas en curso por agente (no se expulsan)
+_closing_tasks: Set[asyncio.Task] = set()  # Cierres de agentes expulsados en segundo plano
 
 class QueryRequest(BaseModel):
     question: str
@@ -31,10 +38,27 @@ class QueryResponse(BaseModel):
     error: Optional[str] = None
     execution_time: Optional[float] = None
 
+def _check_etag(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """Fija el ETag de la respuesta; devuelve un 304 si el cliente ya tiene esa versión."""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
 @router.get("/clients")
-async def get_clients():
+async def get_clients(
+    request: Request,
+    response: Response,
+    client_manager: ClientManager = Depends(get_client_manager)
+):
     """Obtener lista de clientes disponibles."""
     try:
+        # La lista solo cambia si cambia algún JSON de configuración
+        not_modified = _check_etag(request, response, f'"{client_manager.mtime():x}"')
+        if not_modified:
+            return not_modified
+        
         clients = client_manager.list_clients()
         client_data = {}
         
@@ -56,7 +80,12 @@ async def get_clients():
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/clients/{client_id}/files")
-async def get_client_files(client_id: str):
+async def get_client_files(
+    client_id: str,
+    request: Request,
+    response: Response,
+    client_manager: ClientManager = Depends(get_client_manager)
+):
     """Obtener archivos disponibles para un cliente."""
     try:
         config = client_manager.load_client_config(client_id)
@@ -65,28 +94,38 @@ async def get_client_files(client_id: str):
         if not os.path.exists(workspace_folder):
             return {"success": True, "files": []}
         
-        files = []
-        for file_path in Path(workspace_folder).glob("*.xlsx"):
-            if file_path.is_file():
-                files.append({
-                    "name": file_path.name,
-                    "path": str(file_path),
-                    "size": file_path.stat().st_size
-                })
+        # scandir reutiliza el tipo de cada entrada: un único stat por archivo
+        with os.scandir(workspace_folder) as entries:
+            files = [
+                {
+                    "name": entry.name,
+                    "path": entry.path,
+                    "size": entry.stat().st_size
+                }
+                for entry in entries
+                if entry.name.endswith(".xlsx") and not entry.name.startswith(".") and entry.is_file()
+            ]
+        
+        etag = f'"{hashlib.blake2b(dumps_bytes(files), digest_size=16).hexdigest()}"'
+        not_modified = _check_etag(request, response, etag)
+        if not_modified:
+            return not_modified
         
         return {"success": True, "files": files}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/query", response_model=QueryResponse)
-async def process_query(request: QueryRequest):
+async def process_query(
+    request: QueryRequest,
+    client_manager: ClientManager = Depends(get_client_manager)
+):
     """Procesar una consulta del usuario."""
-    import time
     start_time = time.time()
     
     try:
         # Obtener o crear agente para el cliente
-        agent = await get_or_create_agent(request.client_id)
+        agent = await get_or_create_agent(request.client_id, client_manager)
         
         # Determinar archivo a usar
         file_path = request.file_path
@@ -97,8 +136,15 @@ async def process_query(request: QueryRequest):
         if not file_path or not os.path.exists(file_path):
             raise HTTPException(status_code=400, detail="Archivo no encontrado")
         
-        # Procesar consulta
-        result = agent.ask(file_path, request.question, request.sheet_name)
+        # Procesar consulta en el pool de hilos para no bloquear el event loop
+        _agent_inflight[agent] = _agent_inflight.get(agent, 0) + 1
+        try:
+            result = await asyncio.to_thread(agent.ask, file_path, request.question, request.sheet_name)
+        finally:
+            if _agent_inflight[agent] == 1:
+                del _agent_inflight[agent]
+            else:
+                _agent_inflight[agent] -= 1
         
         execution_time = time.time() - start_time
         
@@ -116,32 +162,77 @@ async def process_query(request: QueryRequest):
             execution_time=execution_time
         )
 
-async def get_or_create_agent(client_id: str) -> BaseAgent:
+def _evict_agents(settings, now: float) -> List[BaseAgent]:
+    """
+    Retira los agentes inactivos y los menos usados por encima del máximo.
+    Los que tienen consultas en curso se conservan. Devuelve los retirados para cerrarlos.
+    """
+    evicted = []
+    for client_id, (last_used, agent) in list(current_agents.items()):
+        if len(current_agents) < settings.max_agents and now - last_used < settings.agent_idle_ttl:
+            break
+        if agent in _agent_inflight:
+            continue
+        del current_agents[client_id]
+        evicted.append(agent)
+    return evicted
+
+def _touch_agent(client_id: str, settings) -> Optional[BaseAgent]:
+    """Devuelve el agente cacheado (marcándolo como usado) y aplica la política de expulsión."""
+    entry = current_agents.pop(client_id, None)
+    now = time.monotonic()
+    # close() detiene el worker del sandbox: en un hilo, sin bloquear el event loop ni esta petición
+    for agent in _evict_agents(settings, now):
+        task = asyncio.create_task(asyncio.to_thread(agent.close))
+        _closing_tasks.add(task)
+        task.add_done_callback(_closing_tasks.discard)
+    if entry is None:
+        return None
+    current_agents[client_id] = (now, entry[1])
+    return entry[1]
+
+async def get_or_create_agent(client_id: str, client_manager: ClientManager) -> BaseAgent:
     """Obtener o crear un agente para el cliente especificado."""
-    if client_id not in current_agents:
-        config = client_manager.load_client_config(client_id)
-        settings = get_settings()
-        
-        agent = BaseAgent(
-            client_config=config,
-            api_key=settings.groq_api_key,
-            model=settings.groq_model,
-            cpu_time=settings.sandbox_cpu_time,
-            memory_bytes=settings.sandbox_memory_bytes,
-            sandbox_user=settings.sandbox_user
-        )
-        
-        current_agents[client_id] = agent
+    settings = get_settings()
+    
+    # Camino rápido sin lock: agente ya creado
+    agent = _touch_agent(client_id, settings)
+    if agent is not None:
+        return agent
     
-    return current_agents[client_id]
+    # Arranque en frío serializado por cliente para no crear agentes duplicados
+    lock = _agent_locks.setdefault(client_id, asyncio.Lock())
+    async with lock:
+        try:
+            agent = _touch_agent(client_id, settings)
+            if agent is not None:
+                return agent
+            
+            config = client_manager.load_client_config(client_id)
+            agent = await asyncio.to_thread(
+                BaseAgent,
+                client_config=config,
+                api_key=settings.groq_api_key,
+                model=settings.groq_model,
+                cpu_time=settings.sandbox_cpu_time,
+                memory_bytes=settings.sandbox_memory_bytes,
+                sandbox_user=settings.sandbox_user
+            )
+            current_agents[client_id] = (time.monotonic(), agent)
+            return agent
+        finally:
+            if _agent_locks.get(client_id) is lock:
+                del _agent_locks[client_id]
 
 @router.post("/clear-cache/{client_id}")
 async def clear_cache(client_id: str):
     """Limpiar caché para un cliente específico."""
     try:
-        if client_id in current_agents:
-            current_agents[client_id].clear_cache()
-            del current_agents[client_id]
+        entry = current_agents.pop(client_id, None)
+        if entry is not None:
+            # Ambos esperan a la consulta en curso del agente: fuera del event loop
+            await asyncio.to_thread(entry[1].clear_cache)
+            await asyncio.to_thread(entry[1].close)
         
         return {"success": True, "message": "Cache cleared"}
     except Exception as e:
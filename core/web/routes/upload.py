@@ -2,21 +2,49 @@
 Rutas para manejo de archivos y uploads.
 Permite subir archivos Excel y organizarlos por cliente.
 """
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from pathlib import Path
 import shutil
 import os
-from typing import List
+from functools import lru_cache
+from typing import BinaryIO, List
 
 from core.client_manager import ClientManager
+from core.web.deps import get_client_manager
 
 router = APIRouter()
-client_manager = ClientManager()
+
+# Límites de subida
+MAX_FILE_SIZE_MB = 50
+MAX_FILE_SIZE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Cuerpo multipart completo: archivo más margen para cabeceras y campos del formulario
+MAX_REQUEST_BYTES = MAX_FILE_SIZE_BYTES + 1024 * 1024
+
+def _save_upload(source: BinaryIO, file_path: Path) -> int:
+    """Copia el archivo subido a disco por bloques y devuelve los bytes escritos."""
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(source, buffer, UPLOAD_CHUNK_SIZE)
+        return buffer.tell()
+
+@lru_cache(maxsize=256)
+def _resolved_workspace(workspace_folder: str) -> Path:
+    """Ruta absoluta del workspace (resuelta una vez por carpeta)."""
+    return Path(workspace_folder).resolve()
+
+def _too_large() -> HTTPException:
+    """Error 413 para archivos que superan el límite de subida."""
+    return HTTPException(
+        status_code=413,
+        detail=f"El archivo supera el máximo de {MAX_FILE_SIZE_MB} MB"
+    )
 
 @router.post("/file")
 async def upload_file(
     file: UploadFile = File(...),
-    client_id: str = Form(...)
+    client_id: str = Form(...),
+    client_manager: ClientManager = Depends(get_client_manager)
 ):
     """
     Subir un archivo Excel para un cliente específico.
@@ -40,36 +68,48 @@ async def upload_file(
         # Generar path del archivo
         file_path = workspace_folder / file.filename
         
-        # Guardar archivo
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        # Rechazar antes de copiar si el tamaño ya se conoce
+        if file.size is not None and file.size > MAX_FILE_SIZE_BYTES:
+            raise _too_large()
+        
+        # Guardar archivo por bloques en un hilo (memoria acotada a un bloque)
+        try:
+            total = await run_in_threadpool(_save_upload, file.file, file_path)
+            if total > MAX_FILE_SIZE_BYTES:
+                raise _too_large()
+        except BaseException:
+            # No dejar archivos parciales en el workspace
+            file_path.unlink(missing_ok=True)
+            raise
         
         return {
             "success": True,
             "message": f"Archivo '{file.filename}' subido exitosamente",
             "file_path": str(file_path),
             "client_id": client_id,
-            "file_size": len(content)
+            "file_size": total
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/file")
-async def delete_file(file_path: str, client_id: str):
+async def delete_file(
+    file_path: str,
+    client_id: str,
+    client_manager: ClientManager = Depends(get_client_manager)
+):
     """Eliminar un archivo específico."""
     try:
         # Validar cliente
         config = client_manager.load_client_config(client_id)
-        workspace_folder = Path(config.get_workspace_folder())
+        workspace_root = _resolved_workspace(config.get_workspace_folder())
         
-        # Validar que el archivo esté en la carpeta del cliente
+        # Validar que el archivo esté dentro del workspace del cliente
         file_path_obj = Path(file_path)
-        try:
-            # Verificar que el archivo esté dentro del workspace del cliente
-            file_path_obj.resolve().relative_to(workspace_folder.resolve())
-        except ValueError:
+        if not file_path_obj.resolve().is_relative_to(workspace_root):
             raise HTTPException(
                 status_code=403, 
                 detail="No se puede eliminar archivos fuera del workspace del cliente"
@@ -85,6 +125,8 @@ async def delete_file(file_path: str, client_id: str):
         else:
             raise HTTPException(status_code=404, detail="Archivo no encontrado")
             
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -92,7 +134,7 @@ async def delete_file(file_path: str, client_id: str):
 async def validate_upload_limits():
     """Obtener límites y validaciones para uploads."""
     return {
-        "max_file_size_mb": 50,
+        "max_file_size_mb": MAX_FILE_SIZE_MB,
         "allowed_extensions": [".xlsx", ".xls"],
         "max_files_per_client": 10
     }
@@ -1,41 +1,61 @@
 #!/usr/bin/env python3
 """
 Script para ejecutar el servidor web con uvicorn directamente.
-Uso: python run_web.py
+Uso:
+  python run_web.py                   # Desarrollo (auto-reload)
+  python run_web.py --prod            # Producción (sin reload)
+  python run_web.py --prod --workers 4
 """
-import os
-import subprocess
-import sys
-from pathlib import Path
+import argparse
 
 def main():
-    """Ejecutar el servidor web usando uvicorn directamente."""
+    """Ejecutar el servidor web usando uvicorn en este mismo proceso."""
+    parser = argparse.ArgumentParser(description="Servidor web del Excel Chatbot")
+    parser.add_argument(
+        "--prod",
+        action="store_true",
+        help="Modo producción: sin auto-reload y con varios procesos worker"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Procesos worker en modo producción (default: 1). Cada uno mantiene sus propios agentes y DataFrames en memoria"
+    )
+    args = parser.parse_args()
+    
+    try:
+        import uvicorn
+    except ImportError:
+        print("❌ Error: uvicorn no está instalado")
+        print("💡 Asegúrate de que uvicorn esté instalado: pip install uvicorn")
+        return
+    
     print("🚀 Iniciando Excel Chatbot Web Interface con uvicorn...")
     print("📱 Interfaz disponible en: http://localhost:8000")
     print("📋 API docs en: http://localhost:8000/docs")
     print("⚡ Para parar el servidor: Ctrl+C")
     print("-" * 50)
     
+    if args.prod:
+        # loop/http "auto" usan uvloop y httptools cuando están instalados (uvicorn[standard])
+        options = {"workers": max(1, args.workers), "loop": "auto", "http": "auto"}
+    else:
+        options = {"reload": True, "reload_dirs": ["core", "templates", "config"]}
+    
     try:
-        # Ejecutar uvicorn con configuración simplificada y robusta
-        subprocess.run([
-            sys.executable, "-m", "uvicorn",
+        # uvicorn en proceso: sin lanzar un segundo intérprete solo para arrancarlo
+        uvicorn.run(
             "core.web.app:app",
-            "--host", "0.0.0.0",
-            "--port", "8000",
-            "--reload",
-            "--reload-dir", "core",
-            "--reload-dir", "templates", 
-            "--reload-dir", "config",
-            "--log-level", "info"
-        ], check=True)
+            host="0.0.0.0",
+            port=8000,
+            log_level="info",
+            **options
+        )
     except KeyboardInterrupt:
         print("\n⚠️ Servidor detenido por el usuario")
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Error ejecutando uvicorn: {e}")
-        print("💡 Asegúrate de que uvicorn esté instalado: pip install uvicorn")
     except Exception as e:
         print(f"❌ Error inesperado: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Raíz del proyecto importable y configuración mínima para instanciar Settings
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('GROQ_API_KEY', 'test')
+os.environ.setdefault('SANDBOX_TEMP_DIR', os.path.join(tempfile.gettempdir(), 'excel_agent_tests'))
@@ -0,0 +1,53 @@
+import pytest
+
+from core.executor.sandbox_executor import SandboxExecutor, SecurityError
+
+
+@pytest.fixture(scope='module')
+def sandbox():
+    return SandboxExecutor(user_name='sandbox-test-user')
+
+
+@pytest.mark.parametrize('code', [
+    "import operator\noperator.attrgetter('__class__.__mro__')(())",
+    "print('{0.__class__.__mro__}'.format(df))",
+    "pd.eval('1+1')",
+    "df.eval('a+b')",
+    "print(df.__class__)",
+    "eval('1+1')",
+    "import os",
+    "print(pd._libs)",
+    "import numpy as xp\nprint(xp._core)",
+    "from pandas import _libs",
+    "from pandas._libs import lib",
+    "g = pd.io.common.sys._getframe\nprint(g(0).f_back.f_globals)",
+    "print(df.index._data)",
+    "df = pd.io\nprint(df._x)",
+    "def f(df):\n    return df._mgr",
+])
+def test_rejects_escape_payloads(sandbox, code):
+    with pytest.raises(SecurityError):
+        sandbox.validate_code(code)
+
+
+def test_accepts_plain_pandas_code(sandbox):
+    assert sandbox.validate_code("print(df.groupby('a')['b'].sum())") is True
+
+
+def test_accepts_single_underscore_dataframe_attributes(sandbox):
+    assert sandbox.validate_code("print(df._get_numeric_data().sum())") is True
+    assert sandbox.validate_code("print(df['a']._values)") is True
+
+
+@pytest.mark.parametrize('code', [
+    "print(df.sample(3))",
+    "print(pd.Timestamp('now'))",
+    "print(pd.to_datetime('today'))",
+    "print(pd.date_range(end='Today', periods=3))",
+])
+def test_nondeterministic_code_is_not_cacheable(sandbox, code):
+    assert sandbox.validate_code(code) is False
+
+
+def test_fixed_dates_are_cacheable(sandbox):
+    assert sandbox.validate_code("print(pd.Timestamp('2024-01-01'))") is True
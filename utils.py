@@ -1,9 +1,25 @@
 import json
+import re
 from typing import Any
 from config.logger_config import get_logger
 
+try:
+    import orjson
+except ImportError:  # orjson es opcional: se usa json estándar como fallback
+    orjson = None
+
 logger = get_logger(__name__)
 
+# Secuencias UTF-8 leídas como latin-1 (típico en consolas Windows) y su carácter correcto
+_MOJIBAKE = {
+    'Ã¡': 'á', 'Ã©': 'é', 'Ã\xad': 'í', 'Ã³': 'ó', 'Ã¹': 'ú',
+    'Ã±': 'ñ', 'Ã¼': 'ü', 'Ã§': 'ç', 'Ãº': 'ú'
+}
+_MOJIBAKE_RE = re.compile('|'.join(map(re.escape, _MOJIBAKE)))
+
+# Primer carácter posible de un documento JSON para json.loads (incluye NaN e Infinity)
+_JSON_START = frozenset('{["-0123456789tfnNI')
+
 class CodeAgentError(Exception):
     """Excepción base para errores del CodeAgent."""
     pass
@@ -22,6 +38,40 @@ class LoaderError(CodeAgentError):
     """Error al cargar archivos Excel."""
     pass
 
+def loads_bytes(data: bytes) -> Any:
+    """
+    Deserializa JSON desde bytes UTF-8.
+    Usa orjson si está instalado (sin pasada de decodificación a str).
+    
+    Args:
+        data: Documento JSON en bytes
+        
+    Returns:
+        Any: Objeto deserializado
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dumps_bytes(obj: Any, indent: bool = False) -> bytes:
+    """
+    Serializa un objeto a JSON UTF-8 en bytes (sin escapar caracteres no ASCII).
+    Usa orjson si está instalado.
+    
+    Args:
+        obj: Objeto a serializar
+        indent: Si True, indenta con 2 espacios
+        
+    Returns:
+        bytes: Documento JSON codificado en UTF-8
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False).encode('utf-8')
+
 def parse_output(stdout: str) -> Any:
     """
     Intenta parsear stdout como JSON, si no devuelve la cadena cruda.
@@ -46,21 +96,15 @@ def parse_output(stdout: str) -> Any:
     # Limpiar stdout y manejar problemas de codificación
     clean_stdout = stdout.strip()
     
-    # Intentar corregir problemas comunes de codificación UTF-8 en Windows
-    try:
-        # Si hay caracteres mal codificados, intentar decodificar correctamente
-        if any(char in clean_stdout for char in ['Ã¡', 'Ã©', 'Ã­', 'Ã³', 'Ã¹', 'Ã±', 'Ã¼', 'Ã§', 'Ãº']):
-            # Problemas comunes de latin-1 -> utf-8
-            replacements = {
-                'Ã¡': 'á', 'Ã©': 'é', 'Ã­': 'í', 'Ã³': 'ó', 'Ã¹': 'ú',
-                'Ã±': 'ñ', 'Ã¼': 'ü', 'Ã§': 'ç', 'Ãº': 'ú',
-                'NÃºmero': 'Número', 'Ãºnicos': 'únicos', 'regiÃ³n': 'región'
-            }
-            for bad, good in replacements.items():
-                clean_stdout = clean_stdout.replace(bad, good)
-            logger.debug("Corregidos problemas de codificación en stdout")
-    except Exception as e:
-        logger.debug(f"Error corrigiendo codificación: {e}")
+    # Corregir problemas comunes de codificación UTF-8 en Windows (una sola pasada)
+    clean_stdout, fixed = _MOJIBAKE_RE.subn(lambda m: _MOJIBAKE[m.group()], clean_stdout)
+    if fixed:
+        logger.debug("Corregidos problemas de codificación en stdout")
+    
+    # Texto plano (lo habitual con print): evitar el coste de lanzar JSONDecodeError
+    if clean_stdout[0] not in _JSON_START:
+        logger.debug("stdout no es JSON válido, retornando como texto")
+        return clean_stdout
     
     try:
         # Intentar parsear como JSON